@@ -1,14 +1,30 @@
 from settings import *
+from workload import Workload
+from simulation import Simulation
+from camera import Camera
+from timing import FrameTimer
+from asset_cache import AssetCache
+from gc_monitor import GCMonitor
 import arcade
+import pyglet
+import numpy as np
+from PIL import Image
 
 
 class SpriteUnit(arcade.Sprite):
+    # arcade.Sprite has no __slots__ of its own, so only our fields are compact
+    __slots__ = ('handler', 'x', 'y', 'image_ind', 'rot_vel', 'vel_x', 'vel_y')
+
     def __init__(self, handler, x, y):
         self.handler = handler
         self.x, self.y = x, y
         super().__init__()
-        self.image_ind = randrange(len(handler.images))
-        self.texture = handler.images[self.image_ind]
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        self.x, self.y = x, y
+        self.image_ind = randrange(len(self.handler.images))
+        self.texture = self.handler.images[self.image_ind]
         self.angle = 0
         self.rot_vel = self.get_vel()
         self.vel_x, self.vel_y = self.get_vel(), self.get_vel()
@@ -33,31 +49,118 @@ class SpriteUnit(arcade.Sprite):
         # self.center_x, self.center_y = self.x, self.y
         self.set_position(self.x, self.y)  # much faster
 
+    def set_state(self, x, y, angle):
+        self.x, self.y = x, y
+        self.angle = angle
+        self.set_position(x, y)
+
+
+class BulkWriter:
+    """
+    Writes the simulation arrays straight into a SpriteList's position and angle buffers, one
+    vectorised scatter per frame into each buffer slot, and flags them for the next upload. The
+    sprites' own _position/_angle are left stale, nothing here reads them back
+    """
+    def __init__(self, sprite_list):
+        self.sprite_list = sprite_list
+        self.slots = np.zeros(0, np.int64)
+        self.dirty = True
+
+    def write(self, sim, offset=(0.0, 0.0)):
+        sprite_list = self.sprite_list
+        if self.dirty:
+            # buffer slots are reused after removals, so they are not simply 0..n-1
+            self.slots = np.fromiter((sprite_list.sprite_slot[sprite] for sprite in sprite_list), np.int64,
+                                     len(sprite_list))
+            self.dirty = False
+        x, y, angle = sim.get_state()
+        # fresh views every frame: SpriteList grows these arrays in place, which fails while one is exported
+        pos = np.frombuffer(sprite_list._sprite_pos_data, np.float32).reshape(-1, 2)
+        pos[self.slots, 0] = x - offset[0]
+        pos[self.slots, 1] = y - offset[1]
+        np.frombuffer(sprite_list._sprite_angle_data, np.float32)[self.slots] = angle
+        del pos
+        sprite_list._sprite_pos_changed = True
+        sprite_list._sprite_angle_changed = True
+
 
 class SpriteHandler:
     def __init__(self, app):
         self.app = app
         self.images = self.get_images()
+        self.free_sprites = [] if '--pool' in sys.argv else None
         self.sprites = arcade.SpriteList(use_spatial_hash=False)
         self.sprites.append(SpriteUnit(self, WIN_W // 2, WIN_H // 2))
-
-    def add_sprite(self, x, y):
-        for i in range(NUM_SPRITES_PER_CLICK):
-            self.sprites.append(SpriteUnit(self, x, y))
-
-    def del_sprite(self):
-        for i in range(NUM_SPRITES_PER_CLICK):
+        self.camera = Camera.from_argv()
+        self.visible = self.sprites
+        self.visible_list = arcade.SpriteList(use_spatial_hash=False)
+        self.bulk = BulkWriter(self.sprites) if '--bulk' in sys.argv else None
+        self.sim = Simulation.from_argv(len(self.images), required=self.bulk)
+        if self.sim:
+            self.sim.add_units(self.sprites)
+
+    def add_sprite(self, x, y, num=NUM_SPRITES_PER_CLICK):
+        sprites = [self.get_sprite(x, y) for i in range(num)]
+        self.sprites.extend(sprites)
+        if self.sim:
+            self.sim.add_units(sprites)
+        if self.bulk:
+            self.bulk.dirty = True
+
+    def get_sprite(self, x, y):
+        if not self.free_sprites:
+            return SpriteUnit(self, x, y)
+        sprite = self.free_sprites.pop()
+        sprite.reset(x, y)
+        return sprite
+
+    def del_sprite(self, num=NUM_SPRITES_PER_CLICK):
+        for i in range(num):
             if len(self.sprites):
-                self.sprites.pop()
+                sprite = self.sprites.pop()
+                if self.free_sprites is not None:
+                    self.free_sprites.append(sprite)
+        if self.sim:
+            self.sim.remove(num)
+        if self.bulk:
+            self.bulk.dirty = True
 
     def get_images(self):
-        paths = [item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file()]
+        paths = sorted(item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file())
+        self.asset_cache = AssetCache.from_argv(paths, self.decode_image)
+        if self.asset_cache:
+            return [arcade.Texture(str(path), Image.frombuffer('RGBA', size, data, 'raw', 'RGBA', 0, 1))
+                    for path, (size, data) in zip(paths, self.asset_cache.load())]
         return [arcade.load_texture(str(path)) for path in paths]
 
+    @staticmethod
+    def decode_image(path):
+        image = Image.open(path).convert('RGBA')
+        return image.size, image.tobytes()
+
     def update(self):
-        self.sprites.update()
+        if self.bulk:
+            self.sim.update(self.app.dt)
+            if self.camera:
+                # no culling here, the GPU clips the whole world
+                self.camera.move(self.app.dt)
+            self.bulk.write(self.sim, (self.camera.x, self.camera.y) if self.camera else (0.0, 0.0))
+        elif self.camera:
+            self.sim.update(self.app.dt)
+            self.visible = self.camera.apply(self.sim, self.sprites, self.app.dt)
+        elif self.sim:
+            self.sim.update(self.app.dt)
+            for sprite, (x, y, angle) in zip(self.sprites, self.sim.iter_state()):
+                sprite.set_state(x, y, angle)
+        else:
+            self.sprites.update()
 
     def draw(self):
+        if self.camera and not self.bulk:
+            self.visible_list.clear()
+            self.visible_list.extend(self.visible)
+            self.visible_list.draw()
+            return
         self.sprites.draw()
 
 
@@ -68,6 +171,13 @@ class App(arcade.Window):
         self.text = arcade.Text(text='text', start_x=0, start_y=WIN_H - FONT_SIZE,
                                font_size=FONT_SIZE, color=arcade.color.GREEN, bold=True)
         self.sprite_handler = SpriteHandler(self)
+        self.timer = FrameTimer()
+        self.workload = Workload.from_argv(self, 'arcade')
+        self.gc_monitor = GCMonitor.from_argv(self.timer)
+        if self.workload:
+            # the default 1/60 update rate would cap every measurement at 60 FPS; the draw rate is
+            # raised in run()
+            self.set_update_rate(1 / 1000)
 
     def draw_fps(self):
         arcade.draw_xywh_rectangle_filled(self.text.x, self.text.y, *self.text.content_size,
@@ -82,13 +192,48 @@ class App(arcade.Window):
             self.sprite_handler.del_sprite()
 
     def on_update(self, delta_time):
+        # pyglet dispatches input events between flip() and on_update
+        self.timer.mark('events')
         self.sprite_handler.update()
         self.dt = delta_time
+        self.timer.mark('update')
 
     def on_draw(self):
         self.clear()
         self.sprite_handler.draw()
+        self.timer.mark('draw')
         self.draw_fps()
+        self.timer.mark('hud')
+
+    def flip(self):
+        super().flip()
+        self.timer.mark('present')
+        self.timer.next_frame()
+        # stepped per presented frame: pyglet schedules on_update and on_draw independently, so the
+        # workload's frame times would otherwise be update ticks
+        if self.workload:
+            self.workload.update()
+
+    def run(self):
+        if self.workload and not self.headless:
+            # pyglet.app.run redraws windows every 1/60 s by default
+            pyglet.app.run(1 / 1000)
+        else:
+            super().run()
+
+    def get_stats(self):
+        # llvmpipe here means Mesa's software rasteriser
+        info = self.ctx.info
+        return {'gl': {'vendor': info.VENDOR, 'renderer': info.RENDERER, 'version': self.ctx.gl_version}}
+
+    def quit(self):
+        if '--timing' in sys.argv:
+            self.timer.print_report()
+        if self.gc_monitor:
+            self.gc_monitor.print_report()
+        # arcade.exit() only stops pyglet's event loop, the headless run() loops until the window closes
+        self.close()
+        sys.exit()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,86 @@
+from settings import *
+from cache_file import CacheFile
+import hashlib
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AssetCache(CacheFile):
+    """
+    Decoded sprite pixels as straight-alpha RGBA in one memory-mapped file, keyed on the asset
+    paths, sizes and mtimes. Straight rather than premultiplied alpha because every backend blends
+    straight alpha, so the bytes upload as they are. On a miss the PNGs are decoded by the
+    backend's own decoder on a thread pool (every decoder used here releases the GIL) and the file
+    is written; on a hit nothing is decoded and load() hands out views straight into the mapping,
+    which stays open for the life of the process
+        --asset-cache             upload sprites from the cache
+        --asset-workers N         decoder threads on a miss (default: all cores)
+    """
+    magic = b'ASTC'
+    version = 1
+
+    def __init__(self, paths, decode, num_workers=None):
+        self.paths = paths
+        self.decode = decode
+        self.num_workers = num_workers or os.cpu_count()
+        self.key = self.get_key()
+        self.path = os.path.join(CACHE_DIR_PATH, f'assets_{self.key}.bin')
+        self.mm = None
+        self.images = None
+        self.hit = False
+        self.load_time = 0.0
+
+    @classmethod
+    def from_argv(cls, paths, decode):
+        if '--asset-cache' not in sys.argv:
+            return None
+        return cls(paths, decode, int(get_arg('--asset-workers', 0)))
+
+    def get_key(self):
+        # stat only, so a warm start never reads the PNGs
+        sha = hashlib.sha1(f'{self.version}'.encode())
+        for path in self.paths:
+            stat = os.stat(path)
+            sha.update(f'|{path}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+        return sha.hexdigest()[:16]
+
+    def load(self):
+        """[((w, h), RGBA buffer)] in the order of paths"""
+        if self.images is not None:
+            return self.images
+        start = time.perf_counter()
+        images = self.load_file()
+        self.hit = images is not None
+        if images is None:
+            images = self.decode_all()
+            self.save(images)
+        self.load_time = time.perf_counter() - start
+        self.images = images
+        return images
+
+    def load_file(self):
+        # copy-on-write so ctypes / cffi can take pointers into it
+        loaded = self.read(mmap.ACCESS_COPY)
+        if loaded is None:
+            return None
+        self.mm, header, start = loaded
+        data = memoryview(self.mm)
+        return [((w, h), data[start + offset: start + offset + w * h * 4]) for offset, w, h in header['images']]
+
+    def decode_all(self):
+        with ThreadPoolExecutor(self.num_workers) as pool:
+            return [(size, memoryview(bytearray(blob))) for size, blob in pool.map(self.decode, self.paths)]
+
+    def save(self, images):
+        entries, offset = [], 0
+        for (w, h), blob in images:
+            entries.append((offset, w, h))
+            offset += len(blob)
+        self.write({'paths': [str(path) for path in self.paths], 'images': entries},
+                   [blob for size, blob in images])
+
+    def get_stats(self):
+        return {'hit': self.hit, 'load_ms': self.load_time * 1000, 'images': len(self.paths),
+                'workers': self.num_workers}
@@ -0,0 +1,37 @@
+from settings import *
+import numpy as np
+
+
+class Atlas:
+    """
+    Shelf-packs images of the given sizes into one texture and turns sprite arrays
+    into rotated quads: corners in TL, TR, BR, BL order, uvs normalized to the atlas
+    """
+    corner_signs = np.array([(-1, -1), (1, -1), (1, 1), (-1, 1)], np.float32)
+
+    def __init__(self, sizes, max_width=2048, padding=1):
+        self.rects = []
+        x = y = row_h = 0
+        for w, h in sizes:
+            if x + w > max_width:
+                x, y, row_h = 0, y + row_h + padding, 0
+            self.rects.append((x, y, w, h))
+            x += w + padding
+            row_h = max(row_h, h)
+        self.width = max(rx + w for rx, ry, w, h in self.rects)
+        self.height = y + row_h
+
+        self.half_sizes = np.array([(w * 0.5, h * 0.5) for x, y, w, h in self.rects], np.float32)
+        self.uvs = np.array([[((x + w * (sx > 0)) / self.width, (y + h * (sy > 0)) / self.height)
+                              for sx, sy in self.corner_signs]
+                             for x, y, w, h in self.rects], np.float32)
+
+    def get_quads(self, x, y, angle, image_ind, pos, uv):
+        rad = np.radians(angle)[:, None]
+        cos, sin = np.cos(rad), np.sin(rad)
+        half = self.half_sizes[image_ind]
+        cx = self.corner_signs[:, 0] * half[:, :1]
+        cy = self.corner_signs[:, 1] * half[:, 1:]
+        pos[..., 0] = x[:, None] + cx * cos - cy * sin
+        pos[..., 1] = y[:, None] + cx * sin + cy * cos
+        uv[...] = self.uvs[image_ind]
@@ -0,0 +1,150 @@
+from settings import *
+from bench_stats import get_t_95
+import itertools
+import json
+import os
+import queue
+import statistics
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BACKENDS = {
+    'pygame_cpu': 'pygame_test_cpu.py',
+    'pygame_cpu_cache': 'pygame_test_cpu_cache.py',
+    'pygame_gpu': 'pygame_test_gpu.py',
+    'pysdl2': 'pysdl2_test.py',
+    'arcade': 'arcade_test.py',
+    'raylib': 'raylib_test.py',
+}
+
+
+class BenchMatrix:
+    """
+    Runs every backend x sprite count x NUM_ANGLES x renderer x sim workers cell in its own headless
+    subprocess pinned to dedicated cores, repeated --reps times:
+        python bench_matrix.py --backends pysdl2,pygame_gpu --counts 1000,10000 --reps 5 -- --soa
+    Arguments after -- are passed to every backend. NUM_ANGLES only varies for pygame_cpu_cache
+    and renderers only for pysdl2. --headless means SDL's dummy driver, which only has the
+    software renderer, so other renderers need --video-driver x11|wayland|offscreen. --sim-workers
+    0,1,2,4 runs each cell with that many --sim-workers processes (0: in-process), pinned to one
+    extra core each
+    """
+    def __init__(self):
+        self.backends = get_arg('--backends', ','.join(BACKENDS)).split(',')
+        self.counts = [int(count) for count in get_arg('--counts', '1000,10000').split(',')]
+        self.angles = [int(num) for num in get_arg('--angles', str(NUM_ANGLES)).split(',')]
+        self.renderers = get_arg('--renderers', 'software').split(',')
+        self.video_driver = get_arg('--video-driver')
+        if not self.video_driver and set(self.renderers) - {'software'}:
+            sys.exit('hardware renderers cannot be created under the dummy video driver, '
+                     'pass --video-driver x11|wayland|offscreen')
+        self.sim_workers = [int(num) for num in get_arg('--sim-workers', '0').split(',')]
+        self.frames = int(get_arg('--frames', 300))
+        self.warmup = int(get_arg('--warmup', 60))
+        self.reps = int(get_arg('--reps', 3))
+        self.timeout = float(get_arg('--timeout', 600))
+        self.out_path = get_arg('--out', os.path.join(RESULTS_DIR_PATH, 'matrix.json'))
+        self.extra_args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+
+        cores = sorted(os.sched_getaffinity(0))
+        self.jobs = min(int(get_arg('--jobs', len(cores))), len(cores))
+        self.free_cores = queue.Queue()
+        # a cell takes all of its cores at once, so two cells never wait on each other's halves
+        self.cores_lock = threading.Lock()
+        for core in cores[:self.jobs]:
+            self.free_cores.put(core)
+
+    def get_cells(self):
+        for backend, count in itertools.product(self.backends, self.counts):
+            angles = self.angles if backend == 'pygame_cpu_cache' else [None]
+            renderers = self.renderers if backend == 'pysdl2' else [None]
+            for num_angles, renderer, sim_workers in itertools.product(angles, renderers, self.sim_workers):
+                yield {'backend': backend, 'sprites': count, 'num_angles': num_angles, 'renderer': renderer,
+                       'sim_workers': sim_workers}
+
+    def get_command(self, cell, out_path):
+        command = [sys.executable, BACKENDS[cell['backend']], '--headless',
+                   '--hold', f'{cell["sprites"]}:{self.warmup + self.frames}', '--out', out_path]
+        if cell['num_angles']:
+            command += ['--num-angles', str(cell['num_angles'])]
+        if cell['renderer']:
+            command += ['--use-renderer', cell['renderer']]
+        if cell['renderer'] and cell['renderer'] != 'software':
+            command += ['--video-driver', self.video_driver]
+        if cell['sim_workers']:
+            command += ['--sim-workers', str(cell['sim_workers'])]
+        return command + self.extra_args
+
+    def run_cell(self, cell, rep, tmp_dir):
+        with self.cores_lock:
+            cores = {self.free_cores.get() for i in range(min(1 + cell['sim_workers'], self.jobs))}
+        out_path = os.path.join(tmp_dir, f'{cell["backend"]}_{cell["sprites"]}_{cell["num_angles"]}_'
+                                         f'{cell["renderer"]}_{cell["sim_workers"]}_{rep}.json')
+        try:
+            with subprocess.Popen(self.get_command(cell, out_path), stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL) as proc:
+                # pinned from here, preexec_fn can deadlock when called from pool threads.
+                # Forked sim workers inherit the mask and spread over the extra cores
+                os.sched_setaffinity(proc.pid, cores)
+                try:
+                    proc.wait(timeout=self.timeout)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    raise
+            with open(out_path) as file:
+                frame_times = json.load(file)['frame_times'][self.warmup:]
+            return statistics.fmean(frame_times) if frame_times else None
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            return None
+        finally:
+            for core in cores:
+                self.free_cores.put(core)
+
+    @staticmethod
+    def aggregate(cell, samples):
+        samples = [sample for sample in samples if sample is not None]
+        result = dict(cell, reps=len(samples), frame_time_mean=None, frame_time_ci95=None, fps_mean=None)
+        if not samples:
+            return result
+        mean = statistics.fmean(samples)
+        ci = get_t_95(len(samples) - 1) * statistics.stdev(samples) / len(samples) ** 0.5 if len(samples) > 1 else 0.0
+        result.update(frame_time_mean=mean, frame_time_ci95=ci, fps_mean=1 / mean,
+                      frame_time_samples=samples)
+        return result
+
+    def run(self):
+        cells = list(self.get_cells())
+        print(f'{len(cells)} cells x {self.reps} reps on {self.jobs} cores')
+        with tempfile.TemporaryDirectory() as tmp_dir, ThreadPoolExecutor(self.jobs) as pool:
+            # rep-major order so slow drift of the machine spreads over all cells
+            futures = {(i, rep): pool.submit(self.run_cell, cell, rep, tmp_dir)
+                       for rep in range(self.reps) for i, cell in enumerate(cells)}
+            results = [self.aggregate(cell, [futures[i, rep].result() for rep in range(self.reps)])
+                       for i, cell in enumerate(cells)]
+        self.save(results)
+        self.print_table(results)
+        return results
+
+    def save(self, results):
+        os.makedirs(os.path.dirname(self.out_path) or '.', exist_ok=True)
+        with open(self.out_path, 'w') as file:
+            json.dump({'frames': self.frames, 'warmup': self.warmup, 'reps': self.reps,
+                       'extra_args': self.extra_args, 'cells': results}, file, indent=2)
+
+    @staticmethod
+    def print_table(results):
+        print(f'{"backend":<18}{"sprites":>9}{"angles":>8}{"renderer":>10}{"workers":>9}{"ms/frame":>11}'
+              f'{"±95%":>9}{"fps":>9}')
+        for res in results:
+            if res['frame_time_mean'] is None:
+                print(f'{res["backend"]:<18}{res["sprites"]:>9}{"":>8}{res["renderer"] or "":>10}'
+                      f'{res["sim_workers"]:>9}   failed')
+                continue
+            print(f'{res["backend"]:<18}{res["sprites"]:>9}{res["num_angles"] or "":>8}{res["renderer"] or "":>10}'
+                  f'{res["sim_workers"]:>9}{res["frame_time_mean"] * 1000 :11.3f}{res["frame_time_ci95"] * 1000 :9.3f}{res["fps_mean"] :9.1f}')
+
+
+if __name__ == '__main__':
+    BenchMatrix().run()
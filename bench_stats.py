@@ -0,0 +1,25 @@
+import math
+import statistics
+
+# two-sided 95% Student's t quantiles by degrees of freedom
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+        10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110,
+        18: 2.101, 19: 2.093, 20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060,
+        26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980}
+
+
+def get_t_95(dof):
+    # rounds (Welch's fractional) dof down to a table entry, the conservative side
+    return T_95[max((key for key in T_95 if key <= dof), default=1)]
+
+
+def welch_t_test(a, b):
+    """ returns (t, degrees of freedom) for the difference of means b - a """
+    diff = statistics.fmean(b) - statistics.fmean(a)
+    var_a, var_b = statistics.variance(a) / len(a), statistics.variance(b) / len(b)
+    if not var_a + var_b:
+        # identical samples on both sides: any difference is certain, keep its sign
+        return (math.copysign(math.inf, diff) if diff else 0.0), len(a) + len(b) - 2
+    t = diff / math.sqrt(var_a + var_b)
+    dof = (var_a + var_b) ** 2 / (var_a ** 2 / (len(a) - 1) + var_b ** 2 / (len(b) - 1))
+    return t, dof
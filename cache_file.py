@@ -0,0 +1,42 @@
+from settings import *
+import json
+import mmap
+import os
+import struct
+
+
+class CacheFile:
+    """
+    Binary cache file under cache/, memory-mapped on load:
+        magic | version u32 | header size u32 | json header | data
+    Subclasses set magic and version, and key and path per instance; the header always carries
+    the key, offsets in it are relative to the start of the data
+    """
+    magic = b'\0\0\0\0'
+    version = 1
+    head = struct.Struct('<4sII')
+
+    def read(self, access=mmap.ACCESS_READ):
+        """(mmap, header, data start) or None if the file is missing or stale; the caller closes the mmap"""
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as file:
+            mm = mmap.mmap(file.fileno(), 0, access=access)
+        magic, version, header_size = self.head.unpack_from(mm)
+        header = json.loads(mm[self.head.size: self.head.size + header_size]) if magic == self.magic else {}
+        if version != self.version or header.get('key') != self.key:
+            mm.close()
+            return None
+        return mm, header, self.head.size + header_size
+
+    def write(self, header, blobs):
+        header = json.dumps(dict(header, key=self.key)).encode()
+        os.makedirs(CACHE_DIR_PATH, exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(self.head.pack(self.magic, self.version, len(header)))
+            file.write(header)
+            for blob in blobs:
+                file.write(blob)
+        # atomic so that parallel benchmark processes never see a partial file
+        os.replace(tmp_path, self.path)
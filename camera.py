@@ -0,0 +1,88 @@
+from settings import *
+import math
+import time
+import numpy as np
+
+
+class Camera:
+    """
+    WIN_SIZE viewport scrolling over the WORLD_SIZE world on a fixed Lissajous path. Each frame
+    the simulated positions are bucketed into a coarse grid sorted column-major, so the cells under
+    the viewport are one contiguous slice per column; only those candidates are tested exactly
+    """
+    def __init__(self, cell_size=256, margin=CULL_MARGIN):
+        self.cell_size = cell_size
+        self.margin = margin
+        self.grid_h = int(WORLD_H // cell_size) + 1
+        self.time = 0.0
+        self.x = self.y = 0.0
+        self.visible = np.zeros(0, np.int64)
+        self.state = None
+        self.samples = {}
+
+    @classmethod
+    def from_argv(cls):
+        return cls() if WORLD_SIZE != WIN_SIZE else None
+
+    def move(self, dt):
+        self.time += dt
+        self.x = (WORLD_W - WIN_W) * (0.5 - 0.5 * math.cos(self.time * 0.05))
+        self.y = (WORLD_H - WIN_H) * (0.5 - 0.5 * math.cos(self.time * 0.08))
+
+    def get_cells(self, x, y):
+        cell_x = np.clip(x // self.cell_size, 0, WORLD_W // self.cell_size).astype(np.int64)
+        cell_y = np.clip(y // self.cell_size, 0, self.grid_h - 1).astype(np.int64)
+        return cell_x, cell_y
+
+    def query(self, x, y):
+        cell_x, cell_y = self.get_cells(x, y)
+        keys = cell_x * self.grid_h + cell_y
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+
+        x0, y0 = self.x - self.margin, self.y - self.margin
+        x1, y1 = self.x + WIN_W + self.margin, self.y + WIN_H + self.margin
+        (col0, col1), (row0, row1) = self.get_cells(np.array([x0, x1]), np.array([y0, y1]))
+        cols = np.arange(col0, col1 + 1) * self.grid_h
+        starts = np.searchsorted(sorted_keys, cols + row0, 'left')
+        ends = np.searchsorted(sorted_keys, cols + row1, 'right')
+        candidates = np.concatenate([order[start:end] for start, end in zip(starts, ends)])
+
+        cand_x, cand_y = x[candidates], y[candidates]
+        inside = (cand_x > x0) & (cand_x < x1) & (cand_y > y0) & (cand_y < y1)
+        # keep the simulation order so draw order does not flicker while scrolling
+        return np.sort(candidates[inside])
+
+    def update(self, sim, dt):
+        start = time.perf_counter()
+        self.move(dt)
+        n = sim.size
+        # interpolated positions under --fixed-step
+        self.state = sim.get_state()
+        self.visible = self.query(self.state[0], self.state[1])
+        sample = self.samples.setdefault(n, [0, 0.0, 0])
+        sample[0] += 1
+        sample[1] += time.perf_counter() - start
+        sample[2] += len(self.visible)
+
+    def iter_visible(self, sim):
+        # (sprite index, screen x, screen y, angle) of the visible set
+        visible = self.visible
+        x, y, angle = self.state
+        return zip(visible.tolist(), (x[visible] - self.x).tolist(),
+                   (y[visible] - self.y).tolist(), angle[visible].tolist())
+
+    def apply(self, sim, sprites, dt):
+        # the whole world is simulated, only sprites under the camera get their state applied
+        self.update(sim, dt)
+        visible = []
+        for i, x, y, angle in self.iter_visible(sim):
+            sprite = sprites[i]
+            sprite.set_state(x, y, angle)
+            visible.append(sprite)
+        return visible
+
+    def get_report(self):
+        return [{'sprites': n, 'frames': frames, 'cull_ms': cull / frames * 1000,
+                 'visible': visible / frames}
+                for n, (frames, cull, visible) in sorted(self.samples.items())]
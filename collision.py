@@ -0,0 +1,113 @@
+from settings import *
+import time
+import numpy as np
+
+
+class Collider:
+    """
+    Sprite-vs-sprite bounce on the Simulation arrays. Candidate pairs come either from a
+    uniform-grid spatial hash rebuilt every frame (sort by cell, then scan the cell itself
+    and 4 of its 8 neighbours) or from the naive all-pairs check. A sprite is paired with at most
+    max_cell_pairs sprites from each cell, so a crowded cell grows linearly instead of quadratically
+    """
+    # half neighbourhood so every pair of cells is visited once
+    neighbours = ((1, -1), (1, 0), (1, 1), (0, 1))
+    max_cell_pairs = 16
+
+    def __init__(self, method='grid', radius=COLLIDE_RADIUS):
+        self.method = method
+        self.radius = radius
+        self.cell_size = 2 * radius
+        self.grid_w = int(WORLD_W // self.cell_size) + 1
+        # two spare rows per column so y +- 1 never aliases into the next column
+        self.grid_h = int(WORLD_H // self.cell_size) + 3
+        self.samples = {}
+        self.capped = 0
+
+    def get_grid_pairs(self, x, y):
+        cell_x = np.clip(x // self.cell_size, 0, self.grid_w - 1).astype(np.int64)
+        cell_y = np.clip(y // self.cell_size, 0, self.grid_h - 3).astype(np.int64) + 1
+        keys = cell_x * self.grid_h + cell_y
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        positions = np.arange(len(keys))
+
+        pairs_i, pairs_j = [], []
+        # same cell: only later entries
+        end = np.searchsorted(sorted_keys, sorted_keys, 'right')
+        self.append_ranges(pairs_i, pairs_j, order, positions, positions + 1, end)
+        for dx, dy in self.neighbours:
+            neighbour_keys = sorted_keys + dx * self.grid_h + dy
+            start = np.searchsorted(sorted_keys, neighbour_keys, 'left')
+            end = np.searchsorted(sorted_keys, neighbour_keys, 'right')
+            self.append_ranges(pairs_i, pairs_j, order, positions, start, end)
+        return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+    def append_ranges(self, pairs_i, pairs_j, order, positions, start, end):
+        counts = np.maximum(end - start, 0)
+        self.capped += np.count_nonzero(counts > self.max_cell_pairs)
+        counts = np.minimum(counts, self.max_cell_pairs)
+        total = counts.sum()
+        first = np.repeat(start - np.cumsum(counts) + counts, counts)
+        pairs_i.append(order[np.repeat(positions, counts)])
+        pairs_j.append(order[first + np.arange(total)])
+
+    def get_naive_pairs(self, x, y, block=1024):
+        pairs_i, pairs_j = [], []
+        n = len(x)
+        for i0 in range(0, n, block):
+            rows = np.arange(i0, min(i0 + block, n))
+            dist2 = (x[rows, None] - x[None, :]) ** 2 + (y[rows, None] - y[None, :]) ** 2
+            ii, jj = np.nonzero((dist2 < (2 * self.radius) ** 2) & (rows[:, None] < np.arange(n)[None, :]))
+            pairs_i.append(rows[ii])
+            pairs_j.append(jj)
+        return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+    def resolve(self, sim):
+        n = sim.size
+        if n < 2:
+            return
+        x, y = sim.x[:n], sim.y[:n]
+        vel_x, vel_y = sim.vel_x[:n], sim.vel_y[:n]
+
+        start = time.perf_counter()
+        self.capped = 0
+        if self.method == 'grid':
+            i, j = self.get_grid_pairs(x, y)
+            tests = len(i)
+        else:
+            i, j = self.get_naive_pairs(x, y)
+            tests = n * (n - 1) // 2
+        broadphase = time.perf_counter() - start
+
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        dist2 = dx * dx + dy * dy
+        hit = (dist2 < (2 * self.radius) ** 2) & (dist2 > 0)
+        i, j, dx, dy = i[hit], j[hit], dx[hit], dy[hit]
+        dist = np.sqrt(dist2[hit])
+        nx, ny = dx / dist, dy / dist
+        # exchange the normal velocity components of approaching pairs (equal mass elastic bounce)
+        rel = (vel_x[i] - vel_x[j]) * nx + (vel_y[i] - vel_y[j]) * ny
+        approaching = rel > 0
+        i, j, nx, ny, rel = i[approaching], j[approaching], nx[approaching], ny[approaching], rel[approaching]
+        np.subtract.at(vel_x, i, rel * nx)
+        np.subtract.at(vel_y, i, rel * ny)
+        np.add.at(vel_x, j, rel * nx)
+        np.add.at(vel_y, j, rel * ny)
+
+        sample = self.samples.setdefault(n, [0, 0.0, 0.0, 0, 0, 0])
+        sample[0] += 1
+        sample[1] += broadphase
+        sample[2] += time.perf_counter() - start
+        sample[3] += tests
+        sample[4] += len(dist)
+        sample[5] += self.capped
+
+    def get_report(self):
+        return [{'sprites': n, 'frames': frames,
+                 'broadphase_ms': broadphase / frames * 1000,
+                 'total_ms': total / frames * 1000,
+                 'pair_tests': tests / frames,
+                 'overlaps': overlaps / frames,
+                 'capped_ranges': capped / frames}
+                for n, (frames, broadphase, total, tests, overlaps, capped) in sorted(self.samples.items())]
@@ -0,0 +1,92 @@
+from settings import *
+import gc
+import statistics
+import time
+
+
+class GCMonitor:
+    """
+    Records every cyclic GC run through gc.callbacks against the FrameTimer frame it happened in,
+    with its generation and pause, and correlates those frames with frame-time outliers
+    (frames over OUTLIER_FACTOR x the median):
+        --gc-monitor              hook gc.callbacks, report under 'gc' / on exit
+        --gc-freeze               gc.freeze() everything allocated during startup
+        --gc-threshold A[:B[:C]]  gc.set_threshold(A, B, C) once startup is done
+    """
+    OUTLIER_FACTOR = 2.0
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.events = []
+        self.start = 0.0
+        gc.callbacks.append(self.callback)
+
+    @classmethod
+    def from_argv(cls, timer):
+        # called at the end of App.__init__, so everything frozen here is startup state
+        if '--gc-freeze' in sys.argv:
+            gc.collect()
+            gc.freeze()
+        if '--gc-threshold' in sys.argv:
+            thresholds = [int(value) for value in get_arg('--gc-threshold').split(':')]
+            gc.set_threshold(*thresholds, *gc.get_threshold()[len(thresholds):])
+        return cls(timer) if '--gc-monitor' in sys.argv else None
+
+    def callback(self, phase, info):
+        if phase == 'start':
+            self.start = time.perf_counter()
+        else:
+            self.events.append((self.timer.index, info['generation'], time.perf_counter() - self.start,
+                                info['collected']))
+
+    def stop(self):
+        if self.callback in gc.callbacks:
+            gc.callbacks.remove(self.callback)
+
+    def get_report(self):
+        generations = {}
+        for frame, generation, pause, collected in self.events:
+            generations.setdefault(generation, []).append(pause)
+
+        frame_times = self.timer.get_samples('frame')
+        first = self.timer.index - len(frame_times)
+        gc_frames = {}
+        for frame, generation, pause, collected in self.events:
+            # the frame still in progress has no frame time yet
+            if first <= frame < self.timer.index:
+                gc_frames.setdefault(frame, []).append((generation, pause))
+        threshold = statistics.median(frame_times) * self.OUTLIER_FACTOR if frame_times else 0.0
+        outliers = [first + i for i, frame_time in enumerate(frame_times) if frame_time > threshold]
+        gc_times = [frame_times[frame - first] for frame in gc_frames]
+        other_times = [frame_time for i, frame_time in enumerate(frame_times) if first + i not in gc_frames]
+        worst = sorted(gc_frames, key=lambda frame: frame_times[frame - first], reverse=True)[:10]
+        return {
+            'thresholds': gc.get_threshold(),
+            'frozen': gc.get_freeze_count(),
+            'generations': {generation: {'collections': len(pauses),
+                                         'total_ms': sum(pauses) * 1000,
+                                         'mean_ms': statistics.fmean(pauses) * 1000,
+                                         'max_ms': max(pauses) * 1000}
+                            for generation, pauses in sorted(generations.items())},
+            'frames': len(frame_times),
+            'frames_with_gc': len(gc_frames),
+            'outlier_threshold_ms': threshold * 1000,
+            'outliers': len(outliers),
+            'outliers_with_gc': sum(frame in gc_frames for frame in outliers),
+            'gc_frame_mean_ms': statistics.fmean(gc_times) * 1000 if gc_times else None,
+            'other_frame_mean_ms': statistics.fmean(other_times) * 1000 if other_times else None,
+            'worst_gc_frames': [{'frame': frame, 'frame_ms': frame_times[frame - first] * 1000,
+                                 'gc_ms': sum(pause for generation, pause in gc_frames[frame]) * 1000,
+                                 'generations': [generation for generation, pause in gc_frames[frame]]}
+                                for frame in worst],
+        }
+
+    def print_report(self):
+        report = self.get_report()
+        print(f'gc thresholds {report["thresholds"]}, {report["frozen"]} frozen objects')
+        for generation, stats in report['generations'].items():
+            print(f'gen {generation}: {stats["collections"]} collections, {stats["mean_ms"] :.3f} ms mean, '
+                  f'{stats["max_ms"] :.3f} ms max')
+        print(f'{report["frames_with_gc"]} of {report["frames"]} frames ran a collection; '
+              f'{report["outliers_with_gc"]} of {report["outliers"]} frames over '
+              f'{report["outlier_threshold_ms"] :.2f} ms did')
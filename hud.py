@@ -0,0 +1,28 @@
+from settings import *
+from atlas import Atlas
+
+HUD_CHARS = ''.join(chr(i) for i in range(32, 127))
+
+
+class GlyphAtlas:
+    """
+    Packs glyph cells (advance width x line height) rasterized once by the backend and lays
+    out text as (src rect, dst rect) pairs; the layout is only rebuilt when the text changes
+    """
+    def __init__(self, sizes):
+        self.atlas = Atlas(list(sizes.values()))
+        self.size = self.atlas.width, self.atlas.height
+        self.rects = dict(zip(sizes, self.atlas.rects))
+        self.text = None
+        self.quads = []
+
+    def set_text(self, text, x=0, y=0):
+        if text == self.text:
+            return False
+        self.text = text
+        self.quads = []
+        for char in text:
+            rect = self.rects.get(char, self.rects['?'])
+            self.quads.append((rect, (x, y, rect[2], rect[3])))
+            x += rect[2]
+        return True
@@ -0,0 +1,159 @@
+from settings import *
+import atexit
+import cProfile
+import os
+import pstats
+import threading
+
+
+class Profiler:
+    """
+    Profiles a window of frames and writes collapsed stacks (flamegraph.pl / speedscope input),
+    rooted at the FrameTimer phase each stack ran in. Driven by FrameTimer.mark / next_frame, so
+    samples taken since the last mark are labelled with the phase that mark closes:
+        --profile cprofile|sample   deterministic cProfile, or a thread sampling the main stack
+                                    every --profile-interval ms (default 1)
+        --profile-warmup N          frames skipped before profiling (default 60)
+        --profile-frames N          frames profiled (default 300)
+        --profile-out PATH          default bench_results/profile_<script>_<mode>.folded
+    cProfile only knows caller -> callee edges, so its stacks are exact for the last call and split
+    deeper callers proportionally to their cumulative time; the raw stats are written next to it as .prof
+    """
+    MAX_DEPTH = 64
+    MIN_WEIGHT = 1e-6
+
+    def __init__(self, mode, warmup, frames, out_path, interval):
+        self.mode = mode
+        self.warmup = warmup
+        self.frames = frames
+        self.out_path = out_path
+        self.interval = interval
+        self.active = False
+        self.stacks = {}
+        self.phase_stats = {}
+        self.labels = {}
+        atexit.register(self.finish)
+
+    @classmethod
+    def from_argv(cls):
+        if '--profile' not in sys.argv:
+            return None
+        mode = get_arg('--profile')
+        mode = mode if mode in ('cprofile', 'sample') else 'sample'
+        script = pathlib.Path(sys.argv[0]).stem
+        out_path = get_arg('--profile-out', os.path.join(RESULTS_DIR_PATH, f'profile_{script}_{mode}.folded'))
+        return cls(mode, int(get_arg('--profile-warmup', 60)), int(get_arg('--profile-frames', 300)),
+                   out_path, float(get_arg('--profile-interval', 1)) / 1000)
+
+    def next_frame(self, index):
+        if index == self.warmup:
+            self.start()
+        elif index == self.warmup + self.frames:
+            self.finish()
+
+    def start(self):
+        self.active = True
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return
+        # the sampler needs the GIL to look at the main thread, so hand it over more often
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval / 4))
+        self.main_id = threading.get_ident()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+        self.thread.start()
+
+    def mark(self, phase):
+        if not self.active:
+            return
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            if phase in self.phase_stats:
+                self.phase_stats[phase].add(self.profile)
+            else:
+                self.phase_stats[phase] = pstats.Stats(self.profile)
+            self.profile.clear()
+            self.profile.enable()
+            return
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for stack in pending:
+            key = (phase, *stack)
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def get_label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self.labels[code] = f'{os.path.basename(code.co_filename)}:{name}'.replace(';', ',')
+        return label
+
+    def sample_loop(self):
+        while self.active:
+            frame = sys._current_frames().get(self.main_id)
+            stack = []
+            while frame is not None:
+                stack.append(self.get_label(frame.f_code))
+                frame = frame.f_back
+            del frame
+            with self.lock:
+                self.pending.append(tuple(reversed(stack)))
+            time.sleep(self.interval)
+
+    @staticmethod
+    def get_func_label(func):
+        filename, lineno, name = func
+        if filename == '~':
+            return name.replace(';', ',')
+        return f'{os.path.basename(filename)}:{lineno}:{name}'.replace(';', ',')
+
+    def walk_callers(self, stats, phase, func, suffix, weight, visited):
+        suffix = (self.get_func_label(func), *suffix)
+        callers = {caller: edge for caller, edge in stats[func][4].items() if caller not in visited}
+        total = sum(edge[3] for edge in callers.values())
+        if not total or weight < self.MIN_WEIGHT or len(suffix) >= self.MAX_DEPTH:
+            key = (phase, *suffix)
+            self.stacks[key] = self.stacks.get(key, 0) + weight
+            return
+        for caller, edge in callers.items():
+            self.walk_callers(stats, phase, caller, suffix, weight * edge[3] / total, visited | {caller})
+
+    def get_cprofile_stacks(self):
+        for phase, phase_stats in self.phase_stats.items():
+            stats = phase_stats.stats
+            for func, (cc, nc, tt, ct, callers) in stats.items():
+                if not callers:
+                    key = (phase, self.get_func_label(func))
+                    self.stacks[key] = self.stacks.get(key, 0) + tt
+                # edge[2] is func's own time when called from that caller
+                for caller, edge in callers.items():
+                    if caller != func:
+                        self.walk_callers(stats, phase, caller, (self.get_func_label(func),), edge[2], {func, caller})
+        # collapsed stacks want integer weights: microseconds
+        self.stacks = {key: round(weight * 1e6) for key, weight in self.stacks.items()}
+
+    def finish(self):
+        if not self.active:
+            return
+        self.active = False
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            self.get_cprofile_stacks()
+        else:
+            self.thread.join()
+            sys.setswitchinterval(self.switch_interval)
+
+        os.makedirs(os.path.dirname(self.out_path) or '.', exist_ok=True)
+        with open(self.out_path, 'w') as file:
+            for stack, weight in sorted(self.stacks.items()):
+                if weight:
+                    file.write(f'{";".join(stack)} {weight}\n')
+        if self.mode == 'cprofile' and self.phase_stats:
+            stats, *others = self.phase_stats.values()
+            for other in others:
+                stats.add(other)
+            stats.dump_stats(os.path.splitext(self.out_path)[0] + '.prof')
+        print(f'profile: {len(self.stacks)} stacks written to {self.out_path}')
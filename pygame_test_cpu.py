@@ -1,16 +1,32 @@
 from settings import *
+from workload import Workload
+from simulation import Simulation
+from camera import Camera
+from timing import FrameTimer
+from asset_cache import AssetCache
+from gc_monitor import GCMonitor
 import pygame as pg
 import pygame.freetype as ft
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 class SpriteUnit(pg.sprite.Sprite):
+    # pg.sprite.Sprite still gives every instance a __dict__ for its group set, our fields live in slots
+    __slots__ = ('handler', 'image_ind', 'image', 'rect', 'x', 'y', 'angle', 'rot_vel', 'vel_x', 'vel_y')
+
     def __init__(self, handler, x, y):
         self.handler = handler
         super().__init__(handler.group)
-        self.image_ind = randrange(len(handler.images))
-        self.image = handler.images[self.image_ind]
-        self.rect = self.image.get_rect()
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        # also re-initialises a pooled sprite; draws from random in the same order as a fresh one
+        self.image_ind = randrange(len(self.handler.images))
+        self.image = self.handler.images[self.image_ind]
+        self.rect.size = self.image.get_size()
         self.x, self.y = x, y
         self.angle = 0
         self.rot_vel = self.get_vel()
@@ -30,40 +46,143 @@ class SpriteUnit(pg.sprite.Sprite):
     def rotate(self):
         self.angle += self.rot_vel * self.handler.app.dt
         self.image = pg.transform.rotate(self.handler.images[self.image_ind], self.angle)
-        self.rect = self.image.get_rect()
+        self.rect.size = self.image.get_size()
 
     def update(self):
         self.translate()
         self.rotate()
         self.rect.center = self.x, self.y
 
+    def set_state(self, x, y, angle):
+        self.x, self.y, self.angle = x, y, angle
+        self.image = pg.transform.rotate(self.handler.images[self.image_ind], angle)
+        self.rect.size = self.image.get_size()
+        self.rect.center = x, y
+
 
 class SpriteHandler:
     def __init__(self, app):
         self.app = app
         self.images = self.load_images()
-        self.group = pg.sprite.Group()
+        self.blits = '--blits' in sys.argv
+        self.camera = Camera.from_argv()
+        # a scrolling camera changes the whole screen every frame
+        self.dirty = '--dirty' in sys.argv and not self.camera
+        self.group = pg.sprite.RenderUpdates() if self.dirty else pg.sprite.Group()
+        # --pool recycles despawned sprites instead of constructing new ones
+        self.free_sprites = [] if '--pool' in sys.argv else None
         self.sprites = [SpriteUnit(self, WIN_W // 2, WIN_H // 2)]
+        self.visible = self.sprites
+        self.sim = Simulation.from_argv(len(self.images))
+        if self.sim:
+            self.sim.add_units(self.sprites)
+        # pg.transform.rotate releases the GIL while it touches pixels
+        self.num_workers = int(get_arg('--threads', 0))
+        self.executor = ThreadPoolExecutor(self.num_workers) if self.num_workers else None
+        self.worker_times = [0.0] * self.num_workers
+        self.worker_sprites = [0] * self.num_workers
+        self.num_updates = 0
+
+    def add_sprite(self, x, y, num=NUM_SPRITES_PER_CLICK):
+        sprites = [self.get_sprite(x, y) for i in range(num)]
+        self.sprites.extend(sprites)
+        if self.sim:
+            self.sim.add_units(sprites)
 
-    def add_sprite(self, x, y):
-        for i in range(NUM_SPRITES_PER_CLICK):
-            self.sprites.append(SpriteUnit(self, x, y))
+    def get_sprite(self, x, y):
+        if not self.free_sprites:
+            return SpriteUnit(self, x, y)
+        sprite = self.free_sprites.pop()
+        sprite.reset(x, y)
+        sprite.add(self.group)
+        return sprite
 
-    def del_sprite(self):
-        for i in range(NUM_SPRITES_PER_CLICK):
+    def del_sprite(self, num=NUM_SPRITES_PER_CLICK):
+        for i in range(num):
             if len(self.sprites):
                 sprite = self.sprites.pop()
                 sprite.kill()
+                if self.free_sprites is not None:
+                    self.free_sprites.append(sprite)
+        if self.sim:
+            self.sim.remove(num)
 
     def load_images(self):
-        paths = [item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file()]
+        paths = sorted(item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file())
+        self.asset_cache = AssetCache.from_argv(paths, self.decode_image)
+        if self.asset_cache:
+            return [pg.image.frombuffer(data, size, 'RGBA').convert_alpha() for size, data in self.asset_cache.load()]
         return [pg.image.load(str(path)).convert_alpha() for path in paths]
 
+    @staticmethod
+    def decode_image(path):
+        image = pg.image.load(str(path))
+        return image.get_size(), pg.image.tobytes(image, 'RGBA')
+
     def update(self):
-        self.group.update()
+        if self.camera:
+            self.sim.update(self.app.dt)
+            self.visible = self.camera.apply(self.sim, self.sprites, self.app.dt)
+        elif self.executor:
+            self.update_parallel()
+        elif self.sim:
+            self.sim.update(self.app.dt)
+            for sprite, (x, y, angle) in zip(self.sprites, self.sim.iter_state()):
+                sprite.set_state(x, y, angle)
+        else:
+            self.group.update()
+
+    def update_shard(self, worker, sprites, states):
+        start = time.perf_counter()
+        if states is None:
+            for sprite in sprites:
+                sprite.update()
+        else:
+            for sprite, (x, y, angle) in zip(sprites, states):
+                sprite.set_state(x, y, angle)
+        self.worker_times[worker] += time.perf_counter() - start
+        self.worker_sprites[worker] += len(sprites)
+
+    def update_parallel(self):
+        states = None
+        if self.sim:
+            self.sim.update(self.app.dt)
+            states = list(self.sim.iter_state())
+        # at least 1, an empty scene still joins cleanly
+        shard = max(1, -(-len(self.sprites) // self.num_workers))
+        futures = [self.executor.submit(self.update_shard, worker, self.sprites[i: i + shard],
+                                    states and states[i: i + shard])
+                   for worker, i in enumerate(range(0, len(self.sprites), shard))]
+        # join before draw
+        for future in futures:
+            future.result()
+        self.num_updates += 1
+
+    def get_worker_stats(self):
+        return [{'worker': worker,
+                 'mean_ms': self.worker_times[worker] / max(self.num_updates, 1) * 1000,
+                 'us_per_sprite': self.worker_times[worker] / max(self.worker_sprites[worker], 1) * 1e6}
+                for worker in range(self.num_workers)]
+
+    def print_worker_report(self):
+        print(f'{"worker":<8}{"mean ms":>9}{"us/sprite":>11}')
+        for stats in self.get_worker_stats():
+            print(f'{stats["worker"]:<8}{stats["mean_ms"] :9.3f}{stats["us_per_sprite"] :11.3f}')
 
     def draw(self):
-        self.group.draw(self.app.screen)
+        if self.camera:
+            self.app.screen.blits([(sprite.image, sprite.rect) for sprite in self.visible], False)
+            return
+        if self.dirty:
+            self.group.clear(self.app.screen, self.clear_rect)
+            return self.group.draw(self.app.screen)
+        if self.blits:
+            self.app.screen.blits([(sprite.image, sprite.rect) for sprite in self.sprites], False)
+        else:
+            self.group.draw(self.app.screen)
+
+    def clear_rect(self, surf, rect):
+        surf.fill('black', rect)
 
     def on_mouse_press(self):
         mouse_button = pg.mouse.get_pressed()
@@ -82,35 +201,77 @@ class App:
         self.clock = pg.time.Clock()
         self.font = ft.SysFont('Verdana', FONT_SIZE)
         self.sprite_handler = SpriteHandler(self)
+        self.dirty_rects = []
+        self.fps_rect = pg.Rect(0, 0, 0, 0)
         self.dt = 0.0
+        self.timer = FrameTimer()
+        self.workload = Workload.from_argv(self, 'pygame_cpu')
+        self.gc_monitor = GCMonitor.from_argv(self.timer)
 
     def update(self):
+        if self.workload:
+            self.workload.update()
         self.sprite_handler.update()
-        pg.display.flip()
+        self.timer.mark('update')
+        self.present()
         self.dt = self.clock.tick() * 0.001
+        self.timer.mark('present')
 
     def draw_fps(self):
         fps = f'{self.clock.get_fps() :.0f} FPS | {len(self.sprite_handler.sprites)} SPRITES'
-        self.font.render_to(self.screen, (0, 0), text=fps, fgcolor='green', bgcolor='black')
+        return self.font.render_to(self.screen, (0, 0), text=fps, fgcolor='green', bgcolor='black')
+
+    def present(self):
+        if self.sprite_handler.dirty:
+            pg.display.update(self.dirty_rects)
+        else:
+            pg.display.flip()
 
     def draw(self):
+        if self.sprite_handler.dirty:
+            self.screen.fill('black', self.fps_rect)
+            self.dirty_rects = [self.fps_rect] + self.sprite_handler.draw()
+            self.timer.mark('draw')
+            self.fps_rect = self.draw_fps()
+            self.dirty_rects.append(self.fps_rect)
+            self.timer.mark('hud')
+            return
         self.screen.fill('black')
         self.sprite_handler.draw()
+        self.timer.mark('draw')
         self.draw_fps()
+        self.timer.mark('hud')
 
     def check_events(self):
         for e in pg.event.get():
             if e.type == pg.QUIT or (e.type == pg.KEYDOWN and e.key == pg.K_ESCAPE):
-                pg.quit()
-                sys.exit()
+                self.quit()
             elif e.type == pg.MOUSEBUTTONDOWN:
                 self.sprite_handler.on_mouse_press()
 
+    def get_stats(self):
+        if self.sprite_handler.executor:
+            return {'update_workers': self.sprite_handler.get_worker_stats()}
+        return {}
+
+    def quit(self):
+        if '--timing' in sys.argv:
+            self.timer.print_report()
+        if self.gc_monitor:
+            self.gc_monitor.print_report()
+        if self.sprite_handler.executor:
+            self.sprite_handler.print_worker_report()
+            self.sprite_handler.executor.shutdown()
+        pg.quit()
+        sys.exit()
+
     def run(self):
         while True:
             self.check_events()
+            self.timer.mark('events')
             self.update()
             self.draw()
+            self.timer.next_frame()
 
 
 if __name__ == '__main__':
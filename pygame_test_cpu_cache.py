@@ -1,26 +1,40 @@
 from settings import *
+from workload import Workload
+from simulation import Simulation
+from camera import Camera
+from timing import FrameTimer
+from asset_cache import AssetCache
+from gc_monitor import GCMonitor
+from rot_cache import RotCacheFile, LazyRotCache
 import pygame as pg
 import pygame.freetype as ft
 import sys
 
 
 class SpriteUnit(pg.sprite.Sprite):
+    # pg.sprite.Sprite still gives every instance a __dict__ for its group set, our fields live in slots
+    __slots__ = ('handler', 'image_ind', 'image', 'rect', 'x', 'y', 'angle', 'rot_vel', 'vel_x', 'vel_y')
+
     def __init__(self, handler, x, y):
         self.handler = handler
-        self.x, self.y = x, y
         super().__init__(handler.group)
-        self.image_ind = randrange(len(handler.images))
-        self.image = handler.images[self.image_ind]
-        self.rect = self.image.get_rect()
-        self.vel_x, self.vel_y = self.get_vel(), self.get_vel()
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        self.x, self.y = x, y
+        self.image_ind = randrange(len(self.handler.images))
+        self.image = self.handler.images[self.image_ind]
+        self.rect.size = self.image.get_size()
         self.angle = 0
         self.rot_vel = self.get_vel()
+        self.vel_x, self.vel_y = self.get_vel(), self.get_vel()
 
     def rotate(self):
         self.angle += self.rot_vel * self.handler.app.dt
         self.image = self.handler.rot_cache[self.image_ind][
             int(NUM_ANGLES * (self.angle % 360) / 360)]
-        self.rect = self.image.get_rect()
+        self.rect.size = self.image.get_size()
 
     def translate(self):
         self.x += self.vel_x * self.handler.app.dt
@@ -38,14 +52,42 @@ class SpriteUnit(pg.sprite.Sprite):
         self.rotate()
         self.rect.center = self.x, self.y
 
+    def set_state(self, x, y, angle):
+        self.x, self.y, self.angle = x, y, angle
+        self.image = self.handler.rot_cache[self.image_ind][int(NUM_ANGLES * angle / 360) % NUM_ANGLES]
+        self.rect.size = self.image.get_size()
+        self.rect.center = x, y
+
 
 class SpriteHandler:
     def __init__(self, app):
         self.app = app
+        self.paths = sorted(item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file())
         self.images = self.load_images()
-        self.rot_cache = self.get_rot_cache()
-        self.group = pg.sprite.Group()
+        self.rot_cache = self.load_rot_cache()
+        self.blits = '--blits' in sys.argv
+        self.camera = Camera.from_argv()
+        # a scrolling camera changes the whole screen every frame
+        self.dirty = '--dirty' in sys.argv and not self.camera
+        self.group = pg.sprite.RenderUpdates() if self.dirty else pg.sprite.Group()
+        self.free_sprites = [] if '--pool' in sys.argv else None
         self.sprites = [SpriteUnit(self, WIN_W // 2, WIN_H // 2)]
+        self.visible = self.sprites
+        self.sim = Simulation.from_argv(len(self.images))
+        if self.sim:
+            self.sim.add_units(self.sprites)
+
+    def load_rot_cache(self):
+        if '--lazy-cache' in sys.argv:
+            return LazyRotCache(self.images)
+        if '--no-disk-cache' in sys.argv:
+            return self.get_rot_cache()
+        cache_file = RotCacheFile(self.paths)
+        rot_cache = cache_file.load()
+        if rot_cache is None:
+            rot_cache = self.get_rot_cache()
+            cache_file.save(rot_cache)
+        return rot_cache
 
     def get_rot_cache(self):
         rot_cache = {}
@@ -64,25 +106,66 @@ class SpriteHandler:
         elif mouse_button[2]:
             self.del_sprite()
 
-    def add_sprite(self, x, y):
-        for i in range(NUM_SPRITES_PER_CLICK):
-            self.sprites.append(SpriteUnit(self, x, y))
-
-    def del_sprite(self):
-        for i in range(NUM_SPRITES_PER_CLICK):
+    def add_sprite(self, x, y, num=NUM_SPRITES_PER_CLICK):
+        sprites = [self.get_sprite(x, y) for i in range(num)]
+        self.sprites.extend(sprites)
+        if self.sim:
+            self.sim.add_units(sprites)
+
+    def get_sprite(self, x, y):
+        if not self.free_sprites:
+            return SpriteUnit(self, x, y)
+        sprite = self.free_sprites.pop()
+        sprite.reset(x, y)
+        sprite.add(self.group)
+        return sprite
+
+    def del_sprite(self, num=NUM_SPRITES_PER_CLICK):
+        for i in range(num):
             if len(self.sprites):
                 sprite = self.sprites.pop()
                 sprite.kill()
+                if self.free_sprites is not None:
+                    self.free_sprites.append(sprite)
+        if self.sim:
+            self.sim.remove(num)
 
     def load_images(self):
-        paths = [item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file()]
-        return [pg.image.load(str(path)).convert_alpha() for path in paths]
+        self.asset_cache = AssetCache.from_argv(self.paths, self.decode_image)
+        if self.asset_cache:
+            return [pg.image.frombuffer(data, size, 'RGBA').convert_alpha() for size, data in self.asset_cache.load()]
+        return [pg.image.load(str(path)).convert_alpha() for path in self.paths]
+
+    @staticmethod
+    def decode_image(path):
+        image = pg.image.load(str(path))
+        return image.get_size(), pg.image.tobytes(image, 'RGBA')
 
     def update(self):
-        self.group.update()
+        if self.camera:
+            self.sim.update(self.app.dt)
+            self.visible = self.camera.apply(self.sim, self.sprites, self.app.dt)
+        elif self.sim:
+            self.sim.update(self.app.dt)
+            for sprite, (x, y, angle) in zip(self.sprites, self.sim.iter_state()):
+                sprite.set_state(x, y, angle)
+        else:
+            self.group.update()
 
     def draw(self):
-        self.group.draw(self.app.screen)
+        if self.camera:
+            self.app.screen.blits([(sprite.image, sprite.rect) for sprite in self.visible], False)
+            return
+        if self.dirty:
+            self.group.clear(self.app.screen, self.clear_rect)
+            return self.group.draw(self.app.screen)
+        if self.blits:
+            self.app.screen.blits([(sprite.image, sprite.rect) for sprite in self.sprites], False)
+        else:
+            self.group.draw(self.app.screen)
+
+    def clear_rect(self, surf, rect):
+        surf.fill('black', rect)
 
 
 class App:
@@ -93,34 +176,79 @@ class App:
         self.font = ft.SysFont('Verdana', FONT_SIZE)
         self.dt = 0.0
         self.sprite_handler = SpriteHandler(self)
+        self.timer = FrameTimer()
+        self.dirty_rects = []
+        self.fps_rect = pg.Rect(0, 0, 0, 0)
+        self.workload = Workload.from_argv(self, 'pygame_cpu_cache')
+        self.gc_monitor = GCMonitor.from_argv(self.timer)
 
     def update(self):
-        pg.display.flip()
+        if self.workload:
+            self.workload.update()
+        self.present()
+        self.timer.mark('present')
         self.sprite_handler.update()
         self.dt = self.clock.tick() * 0.001
+        self.timer.mark('update')
+
+    def present(self):
+        if self.sprite_handler.dirty:
+            pg.display.update(self.dirty_rects)
+        else:
+            pg.display.flip()
 
     def draw(self):
+        if self.sprite_handler.dirty:
+            self.screen.fill('black', self.fps_rect)
+            self.dirty_rects = [self.fps_rect] + self.sprite_handler.draw()
+            self.timer.mark('draw')
+            self.fps_rect = self.draw_fps()
+            self.dirty_rects.append(self.fps_rect)
+            self.timer.mark('hud')
+            return
         self.screen.fill('black')
         self.sprite_handler.draw()
+        self.timer.mark('draw')
         self.draw_fps()
+        self.timer.mark('hud')
 
     def draw_fps(self):
         fps = f'{self.clock.get_fps() :.0f} FPS | {len(self.sprite_handler.sprites)} SPRITES'
-        self.font.render_to(self.screen, (0, 0), text=fps, fgcolor='green', bgcolor='black')
+        rot_cache = self.sprite_handler.rot_cache
+        if isinstance(rot_cache, LazyRotCache):
+            fps += f' | CACHE {rot_cache.hit_rate :.0%} {rot_cache.resident_bytes / 1024 ** 2 :.0f} MB'
+        return self.font.render_to(self.screen, (0, 0), text=fps, fgcolor='green', bgcolor='black')
 
     def check_events(self):
         for e in pg.event.get():
             if e.type == pg.QUIT or (e.type == pg.KEYDOWN and e.key == pg.K_ESCAPE):
-                pg.quit()
-                sys.exit()
+                self.quit()
             elif e.type == pg.MOUSEBUTTONDOWN:
                 self.sprite_handler.on_mouse_press()
 
+    def get_stats(self):
+        rot_cache = self.sprite_handler.rot_cache
+        if isinstance(rot_cache, LazyRotCache):
+            return {'rot_cache': rot_cache.get_stats()}
+        return {}
+
+    def quit(self):
+        if '--timing' in sys.argv:
+            self.timer.print_report()
+        if self.gc_monitor:
+            self.gc_monitor.print_report()
+        if isinstance(self.sprite_handler.rot_cache, LazyRotCache):
+            self.sprite_handler.rot_cache.print_report()
+        pg.quit()
+        sys.exit()
+
     def run(self):
         while True:
             self.check_events()
+            self.timer.mark('events')
             self.update()
             self.draw()
+            self.timer.next_frame()
 
 
 if __name__ == '__main__':
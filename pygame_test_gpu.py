@@ -1,18 +1,38 @@
 from settings import *
+from workload import Workload
+from simulation import Simulation
+from camera import Camera
+from timing import FrameTimer
+from asset_cache import AssetCache
+from gc_monitor import GCMonitor
+from hud import GlyphAtlas, HUD_CHARS
 import pygame as pg
-import pygame.freetype as ft
 import sys
 from pygame._sdl2.video import Window, Renderer, Texture, Image
+import numpy as np
 
 
 class SpriteUnit(pg.sprite.Sprite):
+    # pg.sprite.Sprite still gives every instance a __dict__ for its group set, our fields live in slots
+    __slots__ = ('handler', 'image_ind', 'image', 'rect', 'x', 'y', 'angle', 'rot_vel', 'vel_x', 'vel_y')
+
     def __init__(self, handler, x, y):
         self.handler = handler
         super().__init__(handler.group)
         self.image_ind = randrange(len(handler.images))
         self.image = Image(handler.images[self.image_ind])
         self.rect = self.image.get_rect()
-        self.orig_rect = self.rect.copy()
+        self.init_state(x, y)
+
+    def reset(self, x, y):
+        self.image_ind = randrange(len(self.handler.images))
+        texture = self.handler.images[self.image_ind]
+        self.image.texture = texture
+        self.image.srcrect = texture.get_rect()
+        self.rect.size = texture.width, texture.height
+        self.init_state(x, y)
+
+    def init_state(self, x, y):
         self.x, self.y = x, y
         self.angle = 0
         self.rot_vel = randrange(-SPEED, SPEED)
@@ -36,33 +56,79 @@ class SpriteUnit(pg.sprite.Sprite):
         self.rotate()
         self.translate()
 
+    def set_state(self, x, y, angle):
+        self.x, self.y, self.angle = x, y, angle
+        self.image.angle = angle
+        self.rect.center = x, y
+
 
 class SpriteHandler:
     def __init__(self, app):
         self.app = app
         self.images = self.load_images()
         self.group = pg.sprite.Group()
+        self.free_sprites = [] if '--pool' in sys.argv else None
         self.sprites = [SpriteUnit(self, WIN_W // 2, WIN_H // 2)]
+        self.camera = Camera.from_argv()
+        self.visible = self.sprites
+        self.sim = Simulation.from_argv(len(self.images))
+        if self.sim:
+            self.sim.add_units(self.sprites)
+
+    def add_sprite(self, x, y, num=NUM_SPRITES_PER_CLICK):
+        sprites = [self.get_sprite(x, y) for i in range(num)]
+        self.sprites.extend(sprites)
+        if self.sim:
+            self.sim.add_units(sprites)
 
-    def add_sprite(self, x, y):
-        for i in range(NUM_SPRITES_PER_CLICK):
-            self.sprites.append(SpriteUnit(self, x, y))
+    def get_sprite(self, x, y):
+        if not self.free_sprites:
+            return SpriteUnit(self, x, y)
+        sprite = self.free_sprites.pop()
+        sprite.reset(x, y)
+        sprite.add(self.group)
+        return sprite
 
-    def del_sprite(self):
-        for i in range(NUM_SPRITES_PER_CLICK):
+    def del_sprite(self, num=NUM_SPRITES_PER_CLICK):
+        for i in range(num):
             if len(self.sprites):
                 sprite = self.sprites.pop()
                 sprite.kill()
+                if self.free_sprites is not None:
+                    self.free_sprites.append(sprite)
+        if self.sim:
+            self.sim.remove(num)
 
     def load_images(self):
-        paths = [item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file()]
-        images = [pg.image.load(str(path)) for path in paths]
+        paths = sorted(item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file())
+        self.asset_cache = AssetCache.from_argv(paths, self.decode_image)
+        if self.asset_cache:
+            images = [pg.image.frombuffer(data, size, 'RGBA') for size, data in self.asset_cache.load()]
+        else:
+            images = [pg.image.load(str(path)) for path in paths]
         return [Texture.from_surface(self.app.renderer, image) for image in images]
 
+    @staticmethod
+    def decode_image(path):
+        image = pg.image.load(str(path))
+        return image.get_size(), pg.image.tobytes(image, 'RGBA')
+
     def update(self):
-        self.group.update()
+        if self.camera:
+            self.sim.update(self.app.dt)
+            self.visible = self.camera.apply(self.sim, self.sprites, self.app.dt)
+        elif self.sim:
+            self.sim.update(self.app.dt)
+            for sprite, (x, y, angle) in zip(self.sprites, self.sim.iter_state()):
+                sprite.set_state(x, y, angle)
+        else:
+            self.group.update()
 
     def draw(self):
+        if self.camera:
+            for sprite in self.visible:
+                sprite.image.draw(dstrect=sprite.rect)
+            return
         self.group.draw(self.app.renderer)
 
     def on_mouse_press(self):
@@ -74,6 +140,80 @@ class SpriteHandler:
             self.del_sprite()
 
 
+class DirectSpriteHandler(SpriteHandler):
+    """
+    --direct: no SpriteUnit, Image or Group at all. Sprites exist only as Simulation rows and each
+    is drawn with its asset's Texture.draw from the state arrays; pygame's renderer has no
+    batched geometry call, so that is still one SDL_RenderCopyEx per sprite
+    """
+    def __init__(self, app):
+        self.app = app
+        self.images = self.load_images()
+        self.half_sizes = np.array([(image.width * 0.5, image.height * 0.5) for image in self.images])
+        self.free_sprites = None
+        self.camera = Camera.from_argv()
+        self.sim = Simulation.from_argv(len(self.images), required=True)
+        self.sim.spawn(WIN_W // 2, WIN_H // 2, 1)
+
+    @property
+    def sprites(self):
+        return range(self.sim.size)
+
+    def add_sprite(self, x, y, num=NUM_SPRITES_PER_CLICK):
+        self.sim.spawn(x, y, num)
+
+    def del_sprite(self, num=NUM_SPRITES_PER_CLICK):
+        self.sim.remove(num)
+
+    def update(self):
+        self.sim.update(self.app.dt)
+        if self.camera:
+            self.camera.update(self.sim, self.app.dt)
+
+    def draw(self):
+        x, y, angle = self.sim.get_state()
+        image_ind = self.sim.image_ind[:self.sim.size]
+        if self.camera:
+            visible = self.camera.visible
+            x, y, angle, image_ind = x[visible] - self.camera.x, y[visible] - self.camera.y, angle[visible], image_ind[visible]
+        half = self.half_sizes[image_ind]
+        images = self.images
+        for ind, left, top, sprite_angle in zip(image_ind.tolist(), (x - half[:, 0]).tolist(),
+                                                (y - half[:, 1]).tolist(), angle.tolist()):
+            images[ind].draw(None, (left, top), sprite_angle)
+
+
+class HudText:
+    def __init__(self, renderer):
+        self.renderer = renderer
+        font = pg.font.Font(f'{FONTS_DIR_PATH}/verdana.ttf', FONT_SIZE)
+        glyphs = {char: font.render(char, True, 'green', 'black') for char in HUD_CHARS}
+        self.glyph_atlas = GlyphAtlas({char: glyph.get_size() for char, glyph in glyphs.items()})
+        atlas_surf = pg.Surface(self.glyph_atlas.size)
+        for char, glyph in glyphs.items():
+            atlas_surf.blit(glyph, self.glyph_atlas.rects[char][:2])
+        self.texture = Texture.from_surface(renderer, atlas_surf)
+        self.target = None
+        self.src_rect = self.dst_rect = None
+
+    def compose(self, x, y):
+        # glyphs are copied into a target texture only when the text changes
+        quads = self.glyph_atlas.quads
+        w, h = sum(dst[2] for src, dst in quads), self.glyph_atlas.rects['?'][3]
+        if not self.target or w > self.target.width:
+            self.target = Texture(self.renderer, (max(w, FONT_SIZE * 20), h), target=True)
+        self.renderer.target = self.target
+        for src_rect, (dst_x, dst_y, dst_w, dst_h) in quads:
+            self.texture.draw(src_rect, (dst_x - x, 0, dst_w, dst_h))
+        self.renderer.target = None
+        self.src_rect, self.dst_rect = (0, 0, w, h), (x, y, w, h)
+
+    def draw(self, text, x=0, y=0):
+        if self.glyph_atlas.set_text(text, x, y):
+            self.compose(x, y)
+        self.target.draw(self.src_rect, self.dst_rect)
+
+
 class App:
     def __init__(self):
         pg.init()
@@ -81,42 +221,55 @@ class App:
         self.renderer = Renderer(self.window)
         self.renderer.draw_color = (0, 0, 0, 255)
         self.clock = pg.time.Clock()
-        self.sprite_handler = SpriteHandler(self)
+        self.sprite_handler = DirectSpriteHandler(self) if '--direct' in sys.argv else SpriteHandler(self)
         self.dt = 0.0
-        self.font = ft.SysFont('Verdana', FONT_SIZE)
-        self.fps_size = [FONT_SIZE * 13, FONT_SIZE * 1.5]
-        self.fps_surf = pg.Surface(self.fps_size)
+        self.hud = HudText(self.renderer)
+        self.timer = FrameTimer()
+        self.workload = Workload.from_argv(self, 'pygame_gpu')
+        self.gc_monitor = GCMonitor.from_argv(self.timer)
 
     def update(self):
+        if self.workload:
+            self.workload.update()
         self.sprite_handler.update()
         self.dt = self.clock.tick(0) * 0.001
+        self.timer.mark('update')
 
     def draw_fps(self):
-        self.fps_surf.fill('black')
         fps = f'{self.clock.get_fps() :.0f} FPS | {len(self.sprite_handler.sprites)} SPRITES'
-        self.font.render_to(self.fps_surf, (10, 10), text=fps, fgcolor='green', bgcolor='black')
-        tex = Texture.from_surface(self.renderer, self.fps_surf)
-        tex.draw((0, 0, *self.fps_size), (0, 0, *self.fps_size))
+        self.hud.draw(fps, 10, 10)
 
     def draw(self):
         self.renderer.clear()
         self.sprite_handler.draw()
+        self.timer.mark('draw')
         self.draw_fps()
+        self.timer.mark('hud')
         self.renderer.present()
+        self.timer.mark('present')
 
     def check_events(self):
         for e in pg.event.get():
             if e.type == pg.QUIT or (e.type == pg.KEYDOWN and e.key == pg.K_ESCAPE):
-                pg.quit()
-                sys.exit()
+                self.quit()
             elif e.type == pg.MOUSEBUTTONDOWN:
                 self.sprite_handler.on_mouse_press()
 
+    def quit(self):
+        if '--timing' in sys.argv:
+            self.timer.print_report()
+        if self.gc_monitor:
+            self.gc_monitor.print_report()
+        pg.quit()
+        sys.exit()
+
     def run(self):
         while True:
             self.check_events()
+            self.timer.mark('events')
             self.update()
             self.draw()
+            self.timer.next_frame()
 
 
 if __name__ == '__main__':
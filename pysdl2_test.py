@@ -1,17 +1,33 @@
 from settings import *
+from workload import Workload
+from simulation import Simulation
+from camera import Camera
+from timing import FrameTimer
+from asset_cache import AssetCache
+from gc_monitor import GCMonitor
+from hud import GlyphAtlas, HUD_CHARS
+from atlas import Atlas
+import ctypes
 import os
 import sys
+import numpy as np
 from sdl2 import *
 from sdl2.sdlimage import *
 from sdl2.sdlttf import *
 
 
 class SpriteUnit:
+    __slots__ = ('handler', 'image_ind', 'image', 'rect', 'x', 'y', 'angle', 'rot_vel', 'vel_x', 'vel_y')
+
     def __init__(self, handler, x, y):
         self.handler = handler
-        self.image_ind = randrange(len(handler.images))
-        self.image = handler.images[self.image_ind]
-        self.rect = SDL_Rect(x - 32, y - 35, 64, 70)
+        self.rect = SDL_Rect(0, 0, 64, 70)
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        self.image_ind = randrange(len(self.handler.images))
+        self.image = self.handler.images[self.image_ind]
+        self.rect.x, self.rect.y = int(x) - 32, int(y) - 35
         self.x, self.y = x, y
         self.angle = 0.0
         self.rot_vel = randrange(-SPEED, SPEED)
@@ -33,36 +49,193 @@ class SpriteUnit:
         self.rotate()
         self.translate()
 
+    def set_state(self, x, y, angle):
+        self.x, self.y, self.angle = x, y, angle
+        self.rect.x, self.rect.y = int(x) - 32, int(y) - 35
+
     def kill(self):
         pass
 
 
+class GeometryBatch:
+    vertex_dtype = np.dtype([('position', np.float32, 2), ('color', np.uint8, 4), ('tex_coord', np.float32, 2)])
+    quad_indices = np.array([0, 1, 2, 2, 3, 0], np.int32)
+
+    def __init__(self, app, surfaces):
+        self.app = app
+        self.atlas, self.texture = self.load_atlas(surfaces)
+        self.capacity = 0
+        self.reserve(1024)
+
+    def load_atlas(self, surfaces):
+        atlas = Atlas([(surf.contents.w, surf.contents.h) for surf in surfaces])
+        atlas_surf = SDL_CreateRGBSurfaceWithFormat(0, atlas.width, atlas.height, 32, SDL_PIXELFORMAT_RGBA32)
+        for surf, (x, y, w, h) in zip(surfaces, atlas.rects):
+            SDL_SetSurfaceBlendMode(surf, SDL_BLENDMODE_NONE)
+            SDL_BlitSurface(surf, None, atlas_surf, SDL_Rect(x, y, w, h))
+            SDL_FreeSurface(surf)
+        texture = SDL_CreateTextureFromSurface(self.app.renderer, atlas_surf)
+        SDL_SetTextureBlendMode(texture, SDL_BLENDMODE_BLEND)
+        SDL_FreeSurface(atlas_surf)
+        return atlas, texture
+
+    def reserve(self, num):
+        if num <= self.capacity:
+            return
+        self.capacity = max(num, self.capacity * 2)
+        self.vertices = np.zeros((self.capacity, 4), self.vertex_dtype)
+        self.vertices['color'] = 255
+        self.indices = (self.quad_indices + 4 * np.arange(self.capacity, dtype=np.int32)[:, None]).ravel()
+        self.vertices_ptr = self.vertices.ctypes.data_as(ctypes.POINTER(SDL_Vertex))
+        self.indices_ptr = self.indices.ctypes.data_as(ctypes.POINTER(ctypes.c_int))
+
+    def draw(self, sim, camera=None):
+        x, y, angle = sim.get_state()
+        image_ind = sim.image_ind[:sim.size]
+        if camera:
+            visible = camera.visible
+            x, y, angle, image_ind = x[visible] - camera.x, y[visible] - camera.y, angle[visible], image_ind[visible]
+        n = len(image_ind)
+        if not n:
+            return
+        self.reserve(n)
+        quads = self.vertices[:n]
+        self.atlas.get_quads(x, y, angle, image_ind, quads['position'], quads['tex_coord'])
+        SDL_RenderGeometry(self.app.renderer, self.texture, self.vertices_ptr, n * 4, self.indices_ptr, n * 6)
+
+    def destroy(self):
+        SDL_DestroyTexture(self.texture)
+
+
+class HudText:
+    def __init__(self, app):
+        self.app = app
+        glyphs = {char: TTF_RenderText_Shaded(app.font, char.encode(), app.fps_fg, app.fps_bg)
+                  for char in HUD_CHARS}
+        self.glyph_atlas = GlyphAtlas({char: (glyph.contents.w, glyph.contents.h) for char, glyph in glyphs.items()})
+        atlas_surf = SDL_CreateRGBSurfaceWithFormat(0, *self.glyph_atlas.size, 32, SDL_PIXELFORMAT_RGBA32)
+        for char, glyph in glyphs.items():
+            SDL_BlitSurface(glyph, None, atlas_surf, SDL_Rect(*self.glyph_atlas.rects[char]))
+            SDL_FreeSurface(glyph)
+        self.texture = SDL_CreateTextureFromSurface(app.renderer, atlas_surf)
+        SDL_FreeSurface(atlas_surf)
+        self.target = None
+        self.target_w = 0
+        self.src_rect = self.dst_rect = None
+
+    def compose(self, x, y):
+        # glyphs are copied into a target texture only when the text changes
+        quads = self.glyph_atlas.quads
+        w, h = sum(dst[2] for src, dst in quads), self.glyph_atlas.rects['?'][3]
+        if w > self.target_w:
+            if self.target:
+                SDL_DestroyTexture(self.target)
+            self.target_w = max(w, FONT_SIZE * 20)
+            self.target = SDL_CreateTexture(self.app.renderer, SDL_PIXELFORMAT_RGBA8888,
+                                            SDL_TEXTUREACCESS_TARGET, self.target_w, h)
+        SDL_SetRenderTarget(self.app.renderer, self.target)
+        for src_rect, (dst_x, dst_y, dst_w, dst_h) in quads:
+            SDL_RenderCopy(self.app.renderer, self.texture, SDL_Rect(*src_rect), SDL_Rect(dst_x - x, 0, dst_w, dst_h))
+        SDL_SetRenderTarget(self.app.renderer, None)
+        self.src_rect, self.dst_rect = SDL_Rect(0, 0, w, h), SDL_Rect(x, y, w, h)
+
+    def draw(self, text, x=0, y=0):
+        if self.glyph_atlas.set_text(text, x, y):
+            self.compose(x, y)
+        SDL_RenderCopy(self.app.renderer, self.target, self.src_rect, self.dst_rect)
+
+    def destroy(self):
+        SDL_DestroyTexture(self.texture)
+        if self.target:
+            SDL_DestroyTexture(self.target)
+
+
 class SpriteHandler:
     def __init__(self, app):
         self.app = app
+        self.paths = sorted(item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file())
         self.images = self.load_images()
+        self.free_sprites = [] if '--pool' in sys.argv else None
         self.sprites = [SpriteUnit(self, WIN_W // 2, WIN_H // 2)]
+        self.batch = GeometryBatch(app, self.load_surfaces()) if '--geometry' in sys.argv else None
+        self.camera = Camera.from_argv()
+        self.visible = self.sprites
+        self.sim = Simulation.from_argv(len(self.images), required=self.batch)
+        if self.sim:
+            self.sim.add_units(self.sprites)
+
+    def add_sprite(self, x, y, num=NUM_SPRITES_PER_CLICK):
+        sprites = [self.get_sprite(x, y) for i in range(num)]
+        self.sprites.extend(sprites)
+        if self.sim:
+            self.sim.add_units(sprites)
 
-    def add_sprite(self, x, y):
-        for i in range(NUM_SPRITES_PER_CLICK):
-            self.sprites.append(SpriteUnit(self, x, y))
+    def get_sprite(self, x, y):
+        if not self.free_sprites:
+            return SpriteUnit(self, x, y)
+        sprite = self.free_sprites.pop()
+        sprite.reset(x, y)
+        return sprite
 
-    def del_sprite(self):
-        for i in range(NUM_SPRITES_PER_CLICK):
+    def del_sprite(self, num=NUM_SPRITES_PER_CLICK):
+        for i in range(num):
             if len(self.sprites):
                 sprite = self.sprites.pop()
                 sprite.kill()
+                if self.free_sprites is not None:
+                    self.free_sprites.append(sprite)
+        if self.sim:
+            self.sim.remove(num)
 
     def load_images(self):
-        paths = [item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file()]
-        return [IMG_LoadTexture(self.app.renderer, str(path).encode('utf-8')) for path in paths]
+        self.asset_cache = AssetCache.from_argv(self.paths, self.decode_image)
+        if not self.asset_cache:
+            return [IMG_LoadTexture(self.app.renderer, str(path).encode('utf-8')) for path in self.paths]
+        textures = []
+        for surf in self.load_surfaces():
+            textures.append(SDL_CreateTextureFromSurface(self.app.renderer, surf))
+            SDL_FreeSurface(surf)
+        return textures
+
+    def load_surfaces(self):
+        if not self.asset_cache:
+            return [IMG_Load(str(path).encode('utf-8')) for path in self.paths]
+        # the surfaces borrow the cache's pixels, which stay mapped for the life of the process
+        return [SDL_CreateRGBSurfaceWithFormatFrom((ctypes.c_char * len(data)).from_buffer(data), w, h, 32, w * 4,
+                                                   SDL_PIXELFORMAT_RGBA32)
+                for (w, h), data in self.asset_cache.load()]
+
+    @staticmethod
+    def decode_image(path):
+        image = IMG_Load(str(path).encode('utf-8'))
+        surf = SDL_ConvertSurfaceFormat(image, SDL_PIXELFORMAT_RGBA32, 0)
+        size = surf.contents.w, surf.contents.h
+        data = ctypes.string_at(surf.contents.pixels, surf.contents.pitch * size[1])
+        SDL_FreeSurface(image)
+        SDL_FreeSurface(surf)
+        return size, data
 
     def update(self):
-        for sprite in self.sprites:
-            sprite.update()
+        if self.batch:
+            self.sim.update(self.app.dt)
+            if self.camera:
+                self.camera.update(self.sim, self.app.dt)
+        elif self.camera:
+            self.sim.update(self.app.dt)
+            self.visible = self.camera.apply(self.sim, self.sprites, self.app.dt)
+        elif self.sim:
+            self.sim.update(self.app.dt)
+            for sprite, (x, y, angle) in zip(self.sprites, self.sim.iter_state()):
+                sprite.set_state(x, y, angle)
+        else:
+            for sprite in self.sprites:
+                sprite.update()
 
     def draw(self):
-        for sprite in self.sprites:
+        if self.batch:
+            self.batch.draw(self.sim, self.camera)
+            return
+        for sprite in self.visible:
             SDL_RenderCopyEx(
                 self.app.renderer,
                 sprite.image,
@@ -96,6 +269,9 @@ class App:
             self.get_renderer(),
             SDL_RENDERER_ACCELERATED
         )
+        if not self.renderer:
+            # e.g. --use-renderer opengl under the dummy driver; drawing into NULL would time nothing
+            sys.exit(f'SDL_CreateRenderer failed: {SDL_GetError().decode()}')
         self.renderer.draw_color = (0, 0, 0, 255)
         self.fps_bg = SDL_Color(0, 0, 0, 255)
         self.fps_fg = SDL_Color(0, 255, 0, 255)
@@ -103,14 +279,21 @@ class App:
         self.sprite_handler = SpriteHandler(self)
         self.dt = 0.0
         self.font = TTF_OpenFont(os.path.join(pathlib.Path(FONTS_DIR_PATH), 'verdana.ttf').encode('utf-8'), FONT_SIZE)
-        self.fps_size = [FONT_SIZE * 13, FONT_SIZE * 1.5]
+        self.hud = HudText(self)
+        self.fps, self.fps_frames, self.fps_time = 0.0, 0, 0.0
         SDL_SetRenderDrawColor(self.renderer, 0, 0, 0, 255)
         self.clock = SDL_GetPerformanceCounter()
+        self.timer = FrameTimer()
+        self.workload = Workload.from_argv(self, 'pysdl2')
+        self.gc_monitor = GCMonitor.from_argv(self.timer)
 
     def get_renderer(self):
         prefer_order = ['direct3d11', 'direct3d', 'opengl', 'opengles2', 'opengles', 'software']
         if '--allow-d3d12' in sys.argv:
             prefer_order.insert(0, 'direct3d12')
+        if '--headless' in sys.argv:
+            # the dummy video driver cannot create hardware renderers
+            prefer_order.insert(0, 'software')
         if '--use-renderer' in sys.argv:
             prefer_order.insert(0, sys.argv[sys.argv.index('--use-renderer') + 1])
         renderers = []
@@ -128,21 +311,29 @@ class App:
         now = SDL_GetPerformanceCounter()
         self.dt = (now - self.clock) / self.clock_freq
         self.clock = now
+        if self.workload:
+            self.workload.update()
         self.sprite_handler.update()
+        self.timer.mark('update')
 
     def draw_fps(self):
-        fps = f'{(1 / self.dt) :.0f} FPS | {len(self.sprite_handler.sprites)} SPRITES'
-        fps_surf = TTF_RenderText_Shaded(self.font, fps.encode(), self.fps_fg, self.fps_bg)
-        fps_tex = SDL_CreateTextureFromSurface(self.renderer, fps_surf)
-        SDL_RenderCopy(self.renderer, fps_tex, None, SDL_Rect(0, 0, fps_surf.contents.w, fps_surf.contents.h))
-        SDL_DestroyTexture(fps_tex)
-        SDL_FreeSurface(fps_surf)
+        self.fps_frames += 1
+        self.fps_time += self.dt
+        if self.fps_frames == 10:
+            # averaged like pygame's Clock.get_fps so the text only changes every 10 frames
+            self.fps = self.fps_frames / self.fps_time
+            self.fps_frames, self.fps_time = 0, 0.0
+        fps = f'{self.fps :.0f} FPS | {len(self.sprite_handler.sprites)} SPRITES'
+        self.hud.draw(fps)
 
     def draw(self):
         SDL_RenderClear(self.renderer)
         self.sprite_handler.draw()
+        self.timer.mark('draw')
         self.draw_fps()
+        self.timer.mark('hud')
         SDL_RenderPresent(self.renderer)
+        self.timer.mark('present')
 
     def check_events(self):
         e = SDL_Event()
@@ -153,9 +344,16 @@ class App:
                 self.sprite_handler.on_mouse_press(e.button.x, e.button.y, e.button.button == SDL_BUTTON_LEFT)
 
     def quit(self):
+        if '--timing' in sys.argv:
+            self.timer.print_report()
+        if self.gc_monitor:
+            self.gc_monitor.print_report()
         self.sprite_handler.sprites.clear()
         for image in self.sprite_handler.images:
             SDL_DestroyTexture(image)
+        if self.sprite_handler.batch:
+            self.sprite_handler.batch.destroy()
+        self.hud.destroy()
         TTF_CloseFont(self.font)
         TTF_Quit()
         IMG_Quit()
@@ -165,8 +363,10 @@ class App:
     def run(self):
         while True:
             self.check_events()
+            self.timer.mark('events')
             self.update()
             self.draw()
+            self.timer.next_frame()
 
 
 if __name__ == '__main__':
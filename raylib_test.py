@@ -1,19 +1,39 @@
+from settings import *
 import pyray as ray
-from raylib import MOUSE_BUTTON_LEFT, MOUSE_BUTTON_RIGHT
+from raylib import MOUSE_BUTTON_LEFT, MOUSE_BUTTON_RIGHT, FLAG_WINDOW_HIDDEN
+from raylib import ffi, DrawTexturePro, DrawMesh, UpdateMeshBuffer, rlDrawRenderBatchActive
+from raylib import rlDisableBackfaceCulling, rlEnableBackfaceCulling
 from raylib.colors import *
-from settings import *
+import numpy as np
+from workload import Workload
+from simulation import Simulation
+from camera import Camera
+from timing import FrameTimer
+from asset_cache import AssetCache
+from gc_monitor import GCMonitor
+from atlas import Atlas
 
 
 class SpriteUnit:
+    __slots__ = ('handler', 'image_ind', 'image', 'x', 'y', 'angle', 'rot_vel', 'vel_x', 'vel_y', 'center',
+                 'source', 'dest')
+
     def __init__(self, handler, x, y):
         self.handler = handler
-        self.image_ind = randrange(len(handler.images))
-        self.image = handler.images[self.image_ind]
+        # filled in place every frame instead of converting a fresh tuple through cffi
+        self.dest = ffi.new('Rectangle *')
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        self.image_ind = randrange(len(self.handler.images))
+        self.image = self.handler.images[self.image_ind]
         self.x, self.y = x, y
         self.angle = 0
         self.rot_vel = self.get_vel()
         self.vel_x, self.vel_y = self.get_vel(), self.get_vel()
-        self.center = self.image.width * 0.5, self.image.height * 0.5
+        self.center = self.handler.centers[self.image_ind][0]
+        self.source = self.handler.sources[self.image_ind][0]
+        self.dest.width, self.dest.height = self.image.width, self.image.height
 
     def get_vel(self):
         return randrange(-SPEED, SPEED)
@@ -34,38 +54,184 @@ class SpriteUnit:
         self.rotate()
         self.translate()
 
+    def set_state(self, x, y, angle):
+        self.x, self.y, self.angle = x, y, angle
+
     def draw(self):
-        ray.draw_texture_pro(self.image,
-                            (0, 0, self.image.width, self.image.height),
-                            (self.x, self.y, self.image.width, self.image.height),
-                             self.center, self.angle, WHITE)
+        dest = self.dest
+        dest.x = self.x
+        dest.y = self.y
+        DrawTexturePro(self.image, self.source, dest[0], self.center, self.angle, self.handler.tint)
+
+
+class MeshBatch:
+    """
+    Every sprite as two triangles of one dynamic mesh textured with an atlas of all sprites: quads are
+    built from the simulation arrays with numpy into preallocated vertex buffers, uploaded with
+    UpdateMeshBuffer and drawn with a single DrawMesh
+    """
+    # TL, TR, BR, BL corners of Atlas.get_quads as two triangles, raylib meshes have 16-bit indices
+    triangle_corners = (0, 1, 2, 2, 3, 0)
+
+    def __init__(self, pixels):
+        self.atlas = Atlas([size for size, data in pixels])
+        self.material = ray.load_material_default()
+        self.material.maps[ray.MaterialMapIndex.MATERIAL_MAP_ALBEDO].texture = self.load_atlas(pixels)
+        self.transform = ray.matrix_identity()
+        self.mesh = None
+        self.capacity = 0
+        self.reserve(1024)
+
+    def load_atlas(self, pixels):
+        atlas_pixels = np.zeros((self.atlas.height, self.atlas.width, 4), np.uint8)
+        for ((w, h), data), (x, y, w, h) in zip(pixels, self.atlas.rects):
+            atlas_pixels[y: y + h, x: x + w] = np.frombuffer(data, np.uint8).reshape(h, w, 4)
+        image = ray.Image(ffi.from_buffer(atlas_pixels), self.atlas.width, self.atlas.height, 1,
+                          ray.PixelFormat.PIXELFORMAT_UNCOMPRESSED_R8G8B8A8)
+        return ray.load_texture_from_image(image)
+
+    def reserve(self, num):
+        if num <= self.capacity:
+            return
+        self.capacity = max(num, self.capacity * 2)
+        self.corners = np.zeros((self.capacity, 4, 2), np.float32)
+        self.corner_uvs = np.zeros((self.capacity, 4, 2), np.float32)
+        self.vertices = np.zeros((self.capacity, 6, 3), np.float32)
+        self.texcoords = np.zeros((self.capacity, 6, 2), np.float32)
+        self.vertices_ptr = ffi.from_buffer('float[]', self.vertices)
+        self.texcoords_ptr = ffi.from_buffer('float[]', self.texcoords)
+        self.unload_mesh()
+        self.mesh = ffi.new('Mesh *')
+        self.mesh.vertexCount = self.capacity * 6
+        self.mesh.triangleCount = self.capacity * 2
+        self.mesh.vertices = self.vertices_ptr
+        self.mesh.texcoords = self.texcoords_ptr
+        ray.upload_mesh(self.mesh, True)
+
+    def unload_mesh(self):
+        if self.mesh is None:
+            return
+        # the vertex data belongs to numpy, UnloadMesh must only free the GPU buffers
+        self.mesh.vertices = self.mesh.texcoords = ffi.NULL
+        ray.unload_mesh(self.mesh[0])
+
+    def draw(self, sim, camera=None):
+        x, y, angle = sim.get_state()
+        image_ind = sim.image_ind[:sim.size]
+        if camera:
+            visible = camera.visible
+            x, y, angle, image_ind = x[visible] - camera.x, y[visible] - camera.y, angle[visible], image_ind[visible]
+        n = len(image_ind)
+        if not n:
+            return
+        self.reserve(n)
+        self.atlas.get_quads(x, y, angle, image_ind, self.corners[:n], self.corner_uvs[:n])
+        for i, corner in enumerate(self.triangle_corners):
+            self.vertices[:n, i, :2] = self.corners[:n, corner]
+            self.texcoords[:n, i] = self.corner_uvs[:n, corner]
+
+        mesh = self.mesh[0]
+        UpdateMeshBuffer(mesh, 0, self.vertices_ptr, n * 6 * 3 * 4, 0)
+        UpdateMeshBuffer(mesh, 1, self.texcoords_ptr, n * 6 * 2 * 4, 0)
+        mesh.vertexCount = n * 6
+        mesh.triangleCount = n * 2
+        # anything already queued in rlgl's own batch goes first; quads are wound clockwise on screen
+        rlDrawRenderBatchActive()
+        rlDisableBackfaceCulling()
+        DrawMesh(mesh, self.material, self.transform)
+        rlEnableBackfaceCulling()
+
+    def destroy(self):
+        self.unload_mesh()
+        # also unloads the atlas texture
+        ray.unload_material(self.material)
 
 
 class SpriteHandler:
     def __init__(self, app):
         self.app = app
+        self.paths = sorted(item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file())
         self.images = self.load_images()
+        # C structs shared by every SpriteUnit.draw call
+        self.sources = [ffi.new('Rectangle *', (0, 0, image.width, image.height)) for image in self.images]
+        self.centers = [ffi.new('Vector2 *', (image.width * 0.5, image.height * 0.5)) for image in self.images]
+        self.tint_ptr = ffi.new('Color *', WHITE)
+        self.tint = self.tint_ptr[0]
+        self.free_sprites = [] if '--pool' in sys.argv else None
         self.sprites = [SpriteUnit(self, WIN_W // 2, WIN_H // 2)]
+        self.batch = MeshBatch(self.load_pixels()) if '--geometry' in sys.argv else None
+        self.camera = Camera.from_argv()
+        self.visible = self.sprites
+        self.sim = Simulation.from_argv(len(self.images), required=self.batch)
+        if self.sim:
+            self.sim.add_units(self.sprites)
 
-    def add_sprite(self, x, y):
-        for i in range(NUM_SPRITES_PER_CLICK):
-            self.sprites.append(SpriteUnit(self, x, y))
+    def add_sprite(self, x, y, num=NUM_SPRITES_PER_CLICK):
+        sprites = [self.get_sprite(x, y) for i in range(num)]
+        self.sprites.extend(sprites)
+        if self.sim:
+            self.sim.add_units(sprites)
 
-    def del_sprite(self):
-        for i in range(NUM_SPRITES_PER_CLICK):
+    def get_sprite(self, x, y):
+        if not self.free_sprites:
+            return SpriteUnit(self, x, y)
+        sprite = self.free_sprites.pop()
+        sprite.reset(x, y)
+        return sprite
+
+    def del_sprite(self, num=NUM_SPRITES_PER_CLICK):
+        for i in range(num):
             if len(self.sprites):
-                self.sprites.pop()
+                sprite = self.sprites.pop()
+                if self.free_sprites is not None:
+                    self.free_sprites.append(sprite)
+        if self.sim:
+            self.sim.remove(num)
 
     def load_images(self):
-        paths = [item for item in pathlib.Path(SPRITE_DIR_PATH).rglob('*.png') if item.is_file()]
-        return [ray.load_texture(str(path)) for path in paths]
+        self.asset_cache = AssetCache.from_argv(self.paths, self.decode_image)
+        if self.asset_cache:
+            return [ray.load_texture_from_image(ray.Image(ray.ffi.from_buffer(data), w, h, 1,
+                                                          ray.PixelFormat.PIXELFORMAT_UNCOMPRESSED_R8G8B8A8))
+                    for (w, h), data in self.asset_cache.load()]
+        return [ray.load_texture(str(path)) for path in self.paths]
+
+    def load_pixels(self):
+        if self.asset_cache:
+            return self.asset_cache.load()
+        return [self.decode_image(path) for path in self.paths]
+
+    @staticmethod
+    def decode_image(path):
+        image = ray.load_image(str(path))
+        ray.image_format(image, ray.PixelFormat.PIXELFORMAT_UNCOMPRESSED_R8G8B8A8)
+        data = bytes(ray.ffi.buffer(image.data, image.width * image.height * 4))
+        ray.unload_image(image)
+        return (image.width, image.height), data
 
     def update(self):
         self.on_mouse_press()
-        [sprite.update() for sprite in self.sprites]
+        if self.batch:
+            self.sim.update(self.app.dt)
+            if self.camera:
+                self.camera.update(self.sim, self.app.dt)
+        elif self.camera:
+            self.sim.update(self.app.dt)
+            self.visible = self.camera.apply(self.sim, self.sprites, self.app.dt)
+        elif self.sim:
+            self.sim.update(self.app.dt)
+            for sprite, (x, y, angle) in zip(self.sprites, self.sim.iter_state()):
+                sprite.set_state(x, y, angle)
+        else:
+            for sprite in self.sprites:
+                sprite.update()
 
     def draw(self):
-        [sprite.draw() for sprite in self.sprites]
+        if self.batch:
+            self.batch.draw(self.sim, self.camera)
+            return
+        for sprite in self.visible:
+            sprite.draw()
 
     def on_mouse_press(self):
         if ray.is_mouse_button_pressed(MOUSE_BUTTON_LEFT):
@@ -77,9 +243,14 @@ class SpriteHandler:
 
 class App:
     def __init__(self):
+        if '--headless' in sys.argv:
+            ray.set_config_flags(FLAG_WINDOW_HIDDEN)
         ray.init_window(*WIN_SIZE, 'test')
         self.sprite_handler = SpriteHandler(self)
         self.dt = 0.0
+        self.timer = FrameTimer()
+        self.workload = Workload.from_argv(self, 'raylib')
+        self.gc_monitor = GCMonitor.from_argv(self.timer)
 
     def draw_fps(self):
         text = f'{ray.get_fps() :.0f} FPS | {len(self.sprite_handler.sprites)} SPRITES'
@@ -88,25 +259,43 @@ class App:
 
     def update(self):
         self.dt = ray.get_frame_time()
+        if self.workload:
+            self.workload.update()
         self.sprite_handler.update()
+        self.timer.mark('update')
 
     def draw(self):
         ray.begin_drawing()
         ray.clear_background(BLACK)
         self.sprite_handler.draw()
+        self.timer.mark('draw')
         self.draw_fps()
+        self.timer.mark('hud')
+        # swaps buffers and polls input events
         ray.end_drawing()
+        self.timer.mark('present')
 
     def run(self):
         while not ray.window_should_close():
             self.update()
             self.draw()
+            self.timer.next_frame()
         self.destroy()
 
     def destroy(self):
+        if '--timing' in sys.argv:
+            self.timer.print_report()
+        if self.gc_monitor:
+            self.gc_monitor.print_report()
         [ray.unload_texture(tex) for tex in self.sprite_handler.images]
+        if self.sprite_handler.batch:
+            self.sprite_handler.batch.destroy()
         ray.close_window()
 
+    def quit(self):
+        self.destroy()
+        sys.exit()
+
 
 if __name__ == '__main__':
     app = App()
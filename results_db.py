@@ -0,0 +1,197 @@
+from settings import *
+from bench_stats import get_t_95, welch_t_test
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import time
+from array import array
+from importlib import metadata
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created TEXT,
+    git_rev TEXT,
+    git_dirty INTEGER,
+    backend TEXT,
+    mode TEXT,
+    win_size TEXT,
+    speed INTEGER,
+    num_angles INTEGER,
+    args TEXT,
+    versions TEXT,
+    results TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER REFERENCES runs(id),
+    sprites INTEGER,
+    frame_times BLOB
+);
+CREATE INDEX IF NOT EXISTS runs_rev ON runs(git_rev);
+"""
+# options that only change where results go, not what is measured
+IGNORED_ARGS = {'--out': 1, '--db': 1, '--no-db': 0, '--timing': 0, '--gc-monitor': 0}
+
+
+def get_git_rev():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True).stdout.strip())
+        return rev or 'unknown', dirty
+    except OSError:
+        return 'unknown', False
+
+
+def get_versions():
+    versions = {}
+    with open('requirements.txt') as file:
+        for name in file.read().split():
+            try:
+                versions[name] = metadata.version(name)
+            except metadata.PackageNotFoundError:
+                versions[name] = None
+    return versions
+
+
+def get_config_args(argv):
+    args, skip = [], 0
+    for arg in argv:
+        if skip:
+            skip -= 1
+        elif arg in IGNORED_ARGS:
+            skip = IGNORED_ARGS[arg]
+        else:
+            args.append(arg)
+    return ' '.join(args)
+
+
+class ResultsDB:
+    """
+    SQLite store of workload runs keyed by backend, settings, library versions and git revision:
+        python results_db.py list
+        python results_db.py compare BASELINE_REV [CANDIDATE_REV] [--warmup N] [--threshold PCT]
+    """
+    def __init__(self, path=RESULTS_DB_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # parallel matrix cells write concurrently
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.executescript(SCHEMA)
+
+    def record(self, results):
+        git_rev, git_dirty = get_git_rev()
+        settings = results['settings']
+        with self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO runs (created, git_rev, git_dirty, backend, mode, win_size, speed, num_angles, '
+                'args, versions, results) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.strftime('%Y-%m-%d %H:%M:%S'), git_rev, git_dirty, results['backend'],
+                 results['workload']['mode'], 'x'.join(map(str, settings['WIN_SIZE'])), settings['SPEED'],
+                 settings['NUM_ANGLES'], get_config_args(results['argv']), json.dumps(get_versions()),
+                 json.dumps({key: results[key] for key in ('summary', 'report', 'stats', 'phases', 'collision', 'camera', 'gc', 'startup', 'simulation') if key in results})))
+            samples = {}
+            for frame_time, count in zip(results['frame_times'], results['sprite_counts']):
+                samples.setdefault(count, array('d')).append(frame_time)
+            self.conn.executemany('INSERT INTO samples (run_id, sprites, frame_times) VALUES (?, ?, ?)',
+                                  [(cursor.lastrowid, count, times.tobytes()) for count, times in samples.items()])
+        return cursor.lastrowid
+
+    def get_revs(self):
+        return self.conn.execute('SELECT git_rev, MAX(created), COUNT(*) FROM runs GROUP BY git_rev '
+                                 'ORDER BY MAX(created)').fetchall()
+
+    def get_samples(self, git_rev, warmup):
+        groups = {}
+        rows = self.conn.execute(
+            'SELECT backend, win_size, speed, num_angles, args, sprites, frame_times, versions '
+            'FROM runs JOIN samples ON samples.run_id = runs.id WHERE git_rev = ?', (git_rev,))
+        for backend, win_size, speed, num_angles, args, sprites, blob, versions in rows:
+            times = array('d')
+            times.frombytes(blob)
+            key = backend, win_size, speed, num_angles, args, sprites
+            group = groups.setdefault(key, {'run_means': [], 'versions': json.loads(versions)})
+            # consecutive frame times are autocorrelated, each run contributes one independent mean
+            if times[warmup:]:
+                group['run_means'].append(statistics.fmean(times[warmup:]))
+        return groups
+
+    def compare(self, baseline, candidate, warmup=30, threshold=0.02):
+        base_groups = self.get_samples(baseline, warmup)
+        cand_groups = self.get_samples(candidate, warmup)
+        report = []
+        for key in sorted(base_groups.keys() & cand_groups.keys()):
+            base, cand = base_groups[key]['run_means'], cand_groups[key]['run_means']
+            if not base or not cand:
+                continue
+            change = statistics.fmean(cand) / statistics.fmean(base) - 1
+            # a t-test needs at least two runs per revision, otherwise the row is shown unflagged
+            t, dof = welch_t_test(base, cand) if len(base) > 1 and len(cand) > 1 else (None, None)
+            report.append({
+                'key': dict(zip(('backend', 'win_size', 'speed', 'num_angles', 'args', 'sprites'), key)),
+                'runs': (len(base), len(cand)),
+                'baseline_ms': statistics.fmean(base) * 1000,
+                'candidate_ms': statistics.fmean(cand) * 1000,
+                'change': change,
+                't': t,
+                'regression': t is not None and t > get_t_95(dof) and change > threshold,
+                'improvement': t is not None and t < -get_t_95(dof) and change < -threshold,
+                'versions': {name: (base_groups[key]['versions'].get(name), version)
+                             for name, version in cand_groups[key]['versions'].items()
+                             if base_groups[key]['versions'].get(name) != version},
+            })
+        return report
+
+    @staticmethod
+    def print_report(report):
+        for row in report:
+            key = row['key']
+            flag = 'REGRESSION' if row['regression'] else 'improved' if row['improvement'] else \
+                'too few runs' if row['t'] is None else ''
+            print(f'{key["backend"]:<18}{key["sprites"]:>8} {key["args"]:<40.40}'
+                  f'{row["baseline_ms"] :9.3f}{row["candidate_ms"] :9.3f} ms {row["change"] :+8.1%}  {flag}'
+                  + (f'  {row["versions"]}' if row['versions'] else ''))
+
+
+USAGE = 'usage: python results_db.py [list | compare BASELINE_REV [CANDIDATE_REV]] ' \
+        '[--db PATH] [--warmup FRAMES] [--threshold PERCENT]'
+# options of this script that take a value, so it is not mistaken for a revision
+VALUE_OPTIONS = ('--db', '--warmup', '--threshold')
+
+
+def get_positional_args():
+    args, skip = [], False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith('--'):
+            args.append(arg)
+    return args
+
+
+if __name__ == '__main__':
+    db = ResultsDB()
+    args = get_positional_args()
+    command = args[0] if args else 'list'
+    if command == 'list':
+        for rev, created, count in db.get_revs():
+            print(f'{rev:<12}{created}  {count} runs')
+    elif command == 'compare':
+        revs = args[1:3]
+        known_revs = [rev for rev, created, count in db.get_revs()]
+        if not revs or not known_revs:
+            sys.exit(USAGE)
+        baseline = revs[0]
+        candidate = revs[1] if len(revs) > 1 else known_revs[-1]
+        for rev in (baseline, candidate):
+            if rev not in known_revs:
+                sys.exit(f'no runs recorded for revision {rev!r} in {RESULTS_DB_PATH}\n{USAGE}')
+        report = db.compare(baseline, candidate, int(get_arg('--warmup', 30)),
+                            float(get_arg('--threshold', 2)) / 100)
+        db.print_report(report)
+        sys.exit(1 if any(row['regression'] for row in report) else 0)
+    else:
+        sys.exit(USAGE)
@@ -0,0 +1,136 @@
+from settings import *
+from cache_file import CacheFile
+import hashlib
+import os
+from collections import OrderedDict
+import pygame as pg
+
+
+class RotCacheFile(CacheFile):
+    """
+    Pre-rotated frames stored on disk as raw RGBA, keyed on the asset hashes and NUM_ANGLES
+    """
+    magic = b'ROTC'
+    version = 1
+
+    def __init__(self, paths, num_angles=NUM_ANGLES):
+        self.paths = paths
+        self.num_angles = num_angles
+        self.key = self.get_key()
+        self.path = os.path.join(CACHE_DIR_PATH, f'rot_cache_{self.key}.bin')
+
+    def get_key(self):
+        sha = hashlib.sha1(f'{self.version}|{self.num_angles}|{pg.version.ver}'.encode())
+        for path in self.paths:
+            sha.update(pathlib.Path(path).read_bytes())
+        return sha.hexdigest()[:16]
+
+    def load(self):
+        loaded = self.read()
+        if loaded is None:
+            return None
+        mm, header, start = loaded
+        rot_cache = {}
+        with mm, memoryview(mm) as data:
+            for i, frames in enumerate(header['frames']):
+                rot_cache[i] = [self.get_frame(data, start + offset, w, h) for offset, w, h in frames]
+        return rot_cache
+
+    @staticmethod
+    def get_frame(data, offset, w, h):
+        with data[offset: offset + w * h * 4] as blob:
+            return pg.image.frombuffer(blob, (w, h), 'RGBA').convert_alpha()
+
+    def save(self, rot_cache):
+        blobs, frames = [], []
+        offset = 0
+        for i in range(len(rot_cache)):
+            frames.append([])
+            for image in rot_cache[i]:
+                blob = pg.image.tobytes(image, 'RGBA')
+                frames[i].append((offset, *image.get_size()))
+                blobs.append(blob)
+                offset += len(blob)
+        self.write({'num_angles': self.num_angles, 'frames': frames}, blobs)
+
+
+class LazyRotRow:
+    def __init__(self, cache, image_ind):
+        self.cache = cache
+        self.image_ind = image_ind
+
+    def __getitem__(self, angle_ind):
+        return self.cache.get(self.image_ind, angle_ind)
+
+
+class LazyRotCache:
+    """
+    Rotates an (image, angle bucket) pair on first use and keeps the result in an LRU
+    bounded by budget bytes. Indexed like the eager cache: rot_cache[image_ind][angle_ind]
+    """
+    def __init__(self, images, num_angles=NUM_ANGLES, budget=ROT_CACHE_BUDGET):
+        self.images = images
+        self.num_angles = num_angles
+        self.budget = budget
+        self.rows = [LazyRotRow(self, i) for i in range(len(images))]
+        self.frames = OrderedDict()
+        self.touched = set()
+        self.hits = self.misses = self.evictions = 0
+        self.resident_bytes = self.peak_bytes = 0
+
+    def __getitem__(self, image_ind):
+        return self.rows[image_ind]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, image_ind, angle_ind):
+        key = image_ind, angle_ind
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return frame
+
+        self.misses += 1
+        self.touched.add(key)
+        frame = pg.transform.rotate(self.images[image_ind], angle_ind * 360 / self.num_angles)
+        self.frames[key] = frame
+        self.resident_bytes += self.get_size(frame)
+        self.peak_bytes = max(self.peak_bytes, self.resident_bytes)
+        while self.resident_bytes > self.budget and len(self.frames) > 1:
+            old_key, old_frame = self.frames.popitem(last=False)
+            self.resident_bytes -= self.get_size(old_frame)
+            self.evictions += 1
+        return frame
+
+    @staticmethod
+    def get_size(frame):
+        return frame.get_pitch() * frame.get_height()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+            'resident_frames': len(self.frames),
+            'resident_bytes': self.resident_bytes,
+            'peak_bytes': self.peak_bytes,
+            'budget_bytes': self.budget,
+            'working_set_frames': len(self.touched),
+            'total_frames': len(self.images) * self.num_angles,
+        }
+
+    def print_report(self):
+        stats = self.get_stats()
+        print(f'rot cache: {stats["hits"]} hits, {stats["misses"]} misses ({stats["hit_rate"] :.1%} hit rate), '
+              f'{stats["evictions"]} evictions')
+        print(f'{stats["resident_frames"]} frames resident, {stats["resident_bytes"] / 1024 ** 2 :.1f} MiB '
+              f'(peak {stats["peak_bytes"] / 1024 ** 2 :.1f} of {stats["budget_bytes"] / 1024 ** 2 :.0f} MiB budget); '
+              f'working set {stats["working_set_frames"]} of {stats["total_frames"]} frames')
@@ -1,11 +1,35 @@
 import pathlib
+import sys
+import time
 from random import randrange, uniform
 
+# settings is the first project import of every backend, so this is close to process start
+START_TIME = time.perf_counter()
+
+
+def get_arg(name, default=None):
+    # a flag given without a value (last, or followed by another flag) falls back to the default
+    if name in sys.argv:
+        i = sys.argv.index(name) + 1
+        if i < len(sys.argv) and not sys.argv[i].startswith('--'):
+            return sys.argv[i]
+    return default
+
+
 WIN_SIZE = WIN_W, WIN_H = 1600, 900
+WORLD_SCALE = float(get_arg('--world', 1))
+WORLD_SIZE = WORLD_W, WORLD_H = int(WIN_W * WORLD_SCALE), int(WIN_H * WORLD_SCALE)
 SPRITE_DIR_PATH = 'assets/sprites'
 FONTS_DIR_PATH = 'assets/fonts'
+RESULTS_DIR_PATH = 'bench_results'
+CACHE_DIR_PATH = 'cache'
+RESULTS_DB_PATH = get_arg('--db', f'{RESULTS_DIR_PATH}/results.sqlite')
 
 FONT_SIZE = 40
 SPEED = 200
 NUM_SPRITES_PER_CLICK = 100
-NUM_ANGLES = 180
+NUM_ANGLES = int(get_arg('--num-angles', 180))
+COLLIDE_RADIUS = 32
+# half diagonal of a rotated sprite, so sprites straddling the viewport edge are still drawn
+CULL_MARGIN = 48
+ROT_CACHE_BUDGET = int(get_arg('--cache-budget', 64)) * 1024 ** 2
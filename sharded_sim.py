@@ -0,0 +1,171 @@
+from settings import *
+from simulation import Simulation
+import atexit
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+
+def run_worker(conn, work):
+    """Worker loop: ticks rows [start, end) of the shared state and writes them into one render buffer"""
+    shm, sim = None, Simulation(1, capacity=0)
+    sim.work = work
+    while True:
+        message = conn.recv()
+        if message[0] == 'tick':
+            buffer, start, end, dt = message[1:]
+            tick_start = time.perf_counter()
+            for name, array in zip(ShardedSimulation.state_fields, state):
+                setattr(sim, name, array[start:end])
+            sim.size = end - start
+            sim.tick(dt)
+            buffers[buffer, 0, start:end] = sim.x
+            buffers[buffer, 1, start:end] = sim.y
+            buffers[buffer, 2, start:end] = sim.angle
+            conn.send(time.perf_counter() - tick_start)
+            continue
+        # every view into the old block has to go before it can be closed
+        state = buffers = None
+        for name in ShardedSimulation.state_fields:
+            setattr(sim, name, None)
+        if shm:
+            shm.close()
+        if message[0] != 'map':
+            break
+        # forked workers share the parent's resource tracker, which unlinks the block if the parent dies
+        shm = shared_memory.SharedMemory(message[1])
+        state, buffers = ShardedSimulation.get_views(shm, message[2])
+        conn.send(None)
+
+
+class ShardedSimulation(Simulation):
+    """
+    --sim-workers N: the Simulation arrays live in shared memory and every update is split into N
+    contiguous shards, each ticked by a worker process. Workers write x, y, angle into the back half
+    of a double buffer while the main process draws from the front half without copying. The frame
+    fence is the workers' reply: update() waits for the shards kicked by the previous update, flips
+    the buffers and kicks the next tick, so the simulation runs during draw and present and the
+    drawn state is one frame behind. --collide and --fixed-step need every sprite in one process,
+    Simulation.from_argv refuses them together with --sim-workers
+    """
+    state_fields = ('x', 'y', 'vel_x', 'vel_y', 'angle', 'rot_vel')
+
+    def __init__(self, num_images, num_workers, capacity=1024, work=0):
+        super().__init__(num_images, capacity)
+        self.num_workers = num_workers
+        self.shm = None
+        self.retired = []
+        self.buffers = None
+        self.front = 0
+        self.pending = None
+        self.fence_wait = 0.0
+        self.worker_time = [0.0] * num_workers
+        self.frames = 0
+        # workers only touch numpy, fork spares them re-importing the backend. Started first, the
+        # resource tracker is inherited, so attaching in a worker never registers the block twice
+        resource_tracker.ensure_running()
+        context = multiprocessing.get_context('fork')
+        self.conns, self.workers = [], []
+        for i in range(num_workers):
+            conn, worker_conn = context.Pipe()
+            worker = context.Process(target=run_worker, args=(worker_conn, work), daemon=True)
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+        self.map()
+        atexit.register(self.close)
+
+    @staticmethod
+    def get_views(shm, capacity):
+        num_fields = len(ShardedSimulation.state_fields)
+        state = np.ndarray((num_fields, capacity), np.float32, shm.buf)
+        buffers = np.ndarray((2, 3, capacity), np.float32, shm.buf, num_fields * capacity * 4)
+        return state, buffers
+
+    def map(self):
+        # (re)allocates the shared arrays at the current capacity and moves the live rows over
+        n = self.size
+        shm = shared_memory.SharedMemory(create=True, size=(len(self.state_fields) + 6) * self.capacity * 4)
+        state, buffers = self.get_views(shm, self.capacity)
+        for name, array in zip(self.state_fields, state):
+            array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+        if self.buffers is not None:
+            buffers[self.front, :, :n] = self.buffers[self.front, :, :n]
+        self.buffers = buffers
+        for conn in self.conns:
+            conn.send(('map', shm.name, self.capacity))
+        for conn in self.conns:
+            conn.recv()
+        if self.shm:
+            # views handed out by get_state may still point into the old block, it is closed on exit
+            self.shm.unlink()
+            self.retired.append(self.shm)
+        self.shm = shm
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        self.sync()
+        super().reserve(capacity)
+        self.map()
+
+    def sync(self):
+        if self.pending is None:
+            return
+        start = time.perf_counter()
+        for i, conn in enumerate(self.conns):
+            self.worker_time[i] += conn.recv()
+        self.fence_wait += time.perf_counter() - start
+        self.front, self.pending = self.pending, None
+
+    def add(self, x, y, vel_x, vel_y, rot_vel, image_ind, angle=0.0):
+        self.sync()
+        start = self.size
+        super().add(x, y, vel_x, vel_y, rot_vel, image_ind, angle)
+        # new sprites are drawn before any worker has ticked them
+        self.buffers[self.front, :, start:self.size] = (self.x[start:self.size], self.y[start:self.size],
+                                                        self.angle[start:self.size])
+
+    def remove(self, num):
+        self.sync()
+        super().remove(num)
+
+    def get_state(self):
+        n = self.size
+        return self.buffers[self.front, 0, :n], self.buffers[self.front, 1, :n], self.buffers[self.front, 2, :n]
+
+    def update(self, dt):
+        self.sync()
+        self.frames += 1
+        self.ticks += 1
+        buffer = 1 - self.front
+        bounds = np.linspace(0, self.size, self.num_workers + 1).astype(int).tolist()
+        for conn, start, end in zip(self.conns, bounds, bounds[1:]):
+            conn.send(('tick', buffer, start, end, dt))
+        self.pending = buffer
+
+    def get_stats(self):
+        frames = max(self.frames, 1)
+        return dict(super().get_stats(), workers=self.num_workers, fence_wait_ms=self.fence_wait / frames * 1000,
+                    worker_tick_ms=[worker_time / frames * 1000 for worker_time in self.worker_time])
+
+    def close(self):
+        if not self.workers:
+            return
+        self.sync()
+        for conn in self.conns:
+            conn.send(('stop',))
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self.shm.unlink()
+        self.retired.append(self.shm)
+        self.buffers = None
+        for name in self.state_fields:
+            setattr(self, name, np.zeros(0, np.float32))
+        for shm in self.retired:
+            try:
+                shm.close()
+            except BufferError:
+                pass
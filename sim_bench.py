@@ -0,0 +1,83 @@
+from settings import *
+import importlib
+import json
+import os
+
+# render-free, so never open a real window; the backend's workload import reads this
+if '--headless' not in sys.argv:
+    sys.argv.append('--headless')
+from bench_matrix import BACKENDS
+from simulation import Simulation
+
+
+class SimBench:
+    """
+    Render-free update throughput: builds one backend's App, then times only
+    SpriteHandler.update at each sprite count with a fixed dt and reports sprite updates per second.
+    Flags such as --soa or --collide are seen by the backend as usual:
+        python sim_bench.py pysdl2 --counts 10000,100000,1000000 --soa
+    'numpy' times the bare Simulation without any sprite objects, the ceiling for --soa
+        --counts N,N,...          sprite counts (default 10000,100000,1000000)
+        --ticks N                 update() calls timed per count (default 20) ...
+        --budget SECONDS          ... unless they take longer than this (default 10, at least 1 tick)
+        --out PATH                default bench_results/sim_<backend>.json
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.counts = [int(count) for count in get_arg('--counts', '10000,100000,1000000').split(',')]
+        self.ticks = int(get_arg('--ticks', 20))
+        self.budget = float(get_arg('--budget', 10))
+        self.dt = 1 / 60
+        self.out_path = get_arg('--out', os.path.join(RESULTS_DIR_PATH, f'sim_{backend}.json'))
+
+    def get_update(self):
+        if self.backend == 'numpy':
+            sim = Simulation.from_argv(1, required=True)
+
+            def set_count(count):
+                sim.remove(sim.size)
+                sim.spawn(WIN_W // 2, WIN_H // 2, count)
+            return set_count, lambda: sim.update(self.dt), sim
+
+        app = importlib.import_module(BACKENDS[self.backend][:-3]).App()
+        handler = app.sprite_handler
+        app.dt = self.dt
+
+        def set_count(count):
+            diff = count - len(handler.sprites)
+            if diff > 0:
+                handler.add_sprite(WIN_W // 2, WIN_H // 2, diff)
+            elif diff < 0:
+                handler.del_sprite(-diff)
+        return set_count, handler.update, getattr(handler, 'sim', None)
+
+    def run(self):
+        set_count, update, sim = self.get_update()
+        results = []
+        for count in self.counts:
+            set_count(count)
+            update()
+            updates, start = 0, time.perf_counter()
+            first_tick = sim.ticks if sim else 0
+            while updates < self.ticks and (not updates or time.perf_counter() - start < self.budget):
+                update()
+                updates += 1
+            elapsed = time.perf_counter() - start
+            # under --fixed-step one update runs as many ticks as fit into dt
+            ticks = sim.ticks - first_tick if sim else updates
+            results.append({'sprites': count, 'updates': updates, 'ticks': ticks,
+                            'update_ms': elapsed / updates * 1000, 'updates_per_s': updates / elapsed,
+                            'sprite_updates_per_s': count * ticks / elapsed})
+            print(f'{self.backend:<18}{count:>9}{results[-1]["update_ms"] :12.3f} ms'
+                  f'{results[-1]["sprite_updates_per_s"] :16,.0f} sprite updates/s')
+        self.save(results)
+        return results
+
+    def save(self, results):
+        os.makedirs(os.path.dirname(self.out_path) or '.', exist_ok=True)
+        with open(self.out_path, 'w') as file:
+            json.dump({'backend': self.backend, 'argv': sys.argv[1:], 'dt': self.dt, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    SimBench(sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith('--') else 'numpy').run()
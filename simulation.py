@@ -0,0 +1,159 @@
+from settings import *
+from collision import Collider
+import numpy as np
+
+
+class Simulation:
+    """
+    Structure-of-arrays sprite state. Sprites are stored densely in [0, size),
+    add/remove work on the tail so indices stay aligned with handler.sprites.
+    With --fixed-step HZ, update(frame_dt) feeds an accumulator that runs whole ticks of 1 / HZ
+    and get_state() interpolates between the last two ticks for display
+    """
+    fields = ('x', 'y', 'vel_x', 'vel_y', 'angle', 'rot_vel', 'prev_x', 'prev_y', 'prev_angle')
+    MAX_TICKS = 8
+
+    def __init__(self, num_images, capacity=1024):
+        self.num_images = num_images
+        self.size = 0
+        self.capacity = capacity
+        for name in self.fields:
+            setattr(self, name, np.zeros(capacity, np.float32))
+        self.image_ind = np.zeros(capacity, np.int32)
+        self.rng = np.random.default_rng()
+        self.collider = None
+        self.work = 0
+        self.step = None
+        self.accumulator = 0.0
+        self.alpha = 1.0
+        self.ticks = 0
+
+    @classmethod
+    def from_argv(cls, num_images, required=False):
+        # --collide [grid|naive], --world, --fixed-step and --sim-workers need the arrays, so they imply --soa
+        if not (required or '--soa' in sys.argv or '--collide' in sys.argv or '--fixed-step' in sys.argv
+                or '--sim-workers' in sys.argv or WORLD_SIZE != WIN_SIZE):
+            return None
+        work = int(get_arg('--sim-work', 0))
+        if '--sim-workers' in sys.argv:
+            if '--collide' in sys.argv or '--fixed-step' in sys.argv:
+                sys.exit('--collide and --fixed-step need every sprite in one process, drop --sim-workers')
+            from sharded_sim import ShardedSimulation
+            return ShardedSimulation(num_images, int(get_arg('--sim-workers')), work=work)
+        sim = cls(num_images)
+        sim.work = work
+        if '--fixed-step' in sys.argv:
+            sim.step = 1 / float(get_arg('--fixed-step'))
+        if '--collide' in sys.argv:
+            method = get_arg('--collide', 'grid')
+            sim.collider = Collider(method if method in ('grid', 'naive') else 'grid')
+        return sim
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, self.capacity * 2)
+        for name in self.fields + ('image_ind',):
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def add(self, x, y, vel_x, vel_y, rot_vel, image_ind, angle=0.0):
+        num = len(image_ind)
+        start, end = self.size, self.size + num
+        if WORLD_SIZE != WIN_SIZE:
+            # a point spawn would take minutes to spread over a large world
+            x, y = self.rng.uniform(0, WORLD_W, num), self.rng.uniform(0, WORLD_H, num)
+        elif self.collider:
+            # and would put every sprite in one collision cell
+            x, y = self.rng.uniform(0, WIN_W, num), self.rng.uniform(0, WIN_H, num)
+        self.reserve(end)
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.vel_x[start:end] = vel_x
+        self.vel_y[start:end] = vel_y
+        self.angle[start:end] = angle
+        self.rot_vel[start:end] = rot_vel
+        self.image_ind[start:end] = image_ind
+        self.prev_x[start:end] = self.x[start:end]
+        self.prev_y[start:end] = self.y[start:end]
+        self.prev_angle[start:end] = angle
+        self.size = end
+
+    def add_units(self, sprites):
+        self.add([sprite.x for sprite in sprites], [sprite.y for sprite in sprites],
+                 [sprite.vel_x for sprite in sprites], [sprite.vel_y for sprite in sprites],
+                 [sprite.rot_vel for sprite in sprites], [sprite.image_ind for sprite in sprites],
+                 [sprite.angle for sprite in sprites])
+
+    def spawn(self, x, y, num):
+        vel = self.rng.integers(-SPEED, SPEED, (3, num))
+        self.add(x, y, vel[0], vel[1], vel[2], self.rng.integers(0, self.num_images, num))
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def remove(self, num):
+        self.size = max(self.size - num, 0)
+
+    def get_state(self):
+        n = self.size
+        x, y, angle = self.x[:n], self.y[:n], self.angle[:n]
+        if self.step is None:
+            return x, y, angle
+        alpha = self.alpha
+        prev_x, prev_y, prev_angle = self.prev_x[:n], self.prev_y[:n], self.prev_angle[:n]
+        # shortest way round, angles wrap at 360
+        turn = np.remainder(angle - prev_angle + 180, 360) - 180
+        return (prev_x + (x - prev_x) * alpha, prev_y + (y - prev_y) * alpha,
+                np.remainder(prev_angle + turn * alpha, 360))
+
+    def iter_state(self):
+        return zip(*(array.tolist() for array in self.get_state()))
+
+    def update(self, dt):
+        if self.step is None:
+            self.tick(dt)
+            return
+        self.accumulator += dt
+        ticks = min(int(self.accumulator / self.step), self.MAX_TICKS)
+        n = self.size
+        for i in range(ticks):
+            self.prev_x[:n] = self.x[:n]
+            self.prev_y[:n] = self.y[:n]
+            self.prev_angle[:n] = self.angle[:n]
+            self.tick(self.step)
+        # a backlog beyond MAX_TICKS is dropped rather than chased
+        self.accumulator = min(self.accumulator - ticks * self.step, self.step)
+        self.alpha = self.accumulator / self.step
+
+    def get_stats(self):
+        return {'sprites': self.size, 'ticks': self.ticks, 'step': self.step}
+
+    def tick(self, dt):
+        self.ticks += 1
+        n = self.size
+        x, y = self.x[:n], self.y[:n]
+        vel_x, vel_y = self.vel_x[:n], self.vel_y[:n]
+        x += vel_x * dt
+        y += vel_y * dt
+        vel_x[(x < 0) | (x > WORLD_W)] *= -1
+        vel_y[(y < 0) | (y > WORLD_H)] *= -1
+        if self.collider:
+            self.collider.resolve(self)
+        angle = self.angle[:n]
+        angle += self.rot_vel[:n] * dt
+        np.remainder(angle, 360, out=angle)
+        if self.work:
+            self.think(n)
+
+    def think(self, n):
+        # --sim-work N: N rounds of steering-style math per sprite standing in for heavier game
+        # logic; the result is discarded so motion stays identical
+        x, y = self.x[:n], self.y[:n]
+        for i in range(self.work):
+            dx, dy = WORLD_W * 0.5 - x, WORLD_H * 0.5 - y
+            dist = np.hypot(dx, dy) + 1.0
+            np.arctan2(dy / dist, dx / dist)
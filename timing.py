@@ -0,0 +1,71 @@
+from settings import *
+from profiler import Profiler
+import time
+from array import array
+
+
+class FrameTimer:
+    """
+    Per-phase frame timing into preallocated ring buffers. mark(phase) charges the time
+    since the previous mark to phase, next_frame() closes the frame and clears the next slot
+    """
+    PHASES = ('events', 'update', 'draw', 'hud', 'present')
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.buffers = {phase: array('d', bytes(8 * capacity)) for phase in self.PHASES + ('frame',)}
+        self.buffer_list = list(self.buffers.values())
+        self.frame_buffer = self.buffers['frame']
+        self.index = 0
+        self.frame_start = self.last = time.perf_counter()
+        self.first_frame = None
+        # every backend drives its frame loop through the timer, so --profile hooks in here
+        self.profiler = Profiler.from_argv()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.buffers[phase][self.index % self.capacity] += now - self.last
+        self.last = now
+        if self.profiler:
+            self.profiler.mark(phase)
+
+    def next_frame(self):
+        now = time.perf_counter()
+        self.frame_buffer[self.index % self.capacity] = now - self.frame_start
+        if self.first_frame is None:
+            self.first_frame = now - START_TIME
+        self.index += 1
+        slot = self.index % self.capacity
+        for buffer in self.buffer_list:
+            buffer[slot] = 0.0
+        self.frame_start = self.last = now
+        if self.profiler:
+            self.profiler.next_frame(self.index)
+
+    def get_samples(self, phase):
+        buffer = self.buffers[phase]
+        num = min(self.index, self.capacity - 1)
+        return [buffer[i % self.capacity] for i in range(self.index - num, self.index)]
+
+    @staticmethod
+    def get_percentiles(samples):
+        if not samples:
+            return {}
+        samples = sorted(samples)
+        num = len(samples)
+        return {'mean': sum(samples) / num * 1000,
+                'p50': samples[num // 2] * 1000,
+                'p95': samples[min(int(num * 0.95), num - 1)] * 1000,
+                'p99': samples[min(int(num * 0.99), num - 1)] * 1000,
+                'max': samples[-1] * 1000}
+
+    def get_report(self):
+        return {phase: self.get_percentiles(self.get_samples(phase)) for phase in self.buffers}
+
+    def print_report(self):
+        if self.first_frame is not None:
+            print(f'time to first frame {self.first_frame * 1000 :.1f} ms')
+        print(f'{"phase (ms)":<10}{"mean":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}')
+        for phase, stats in self.get_report().items():
+            if stats:
+                print(f'{phase:<10}' + ''.join(f'{stats[key] :9.3f}' for key in ('mean', 'p50', 'p95', 'p99', 'max')))
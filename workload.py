@@ -0,0 +1,318 @@
+from settings import *
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from results_db import ResultsDB
+
+# must run before SDL / pyglet initialise their video subsystems
+if '--headless' in sys.argv:
+    os.environ.setdefault('SDL_VIDEODRIVER', get_arg('--video-driver', 'dummy'))
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    os.environ.setdefault('ARCADE_HEADLESS', '1')
+
+
+def get_rss():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class Workload:
+    """
+    Scripted sprite ramp that replaces mouse clicks:
+        --ramp STEP:SECONDS:MAX   add STEP sprites every SECONDS until MAX
+        --hold COUNT:FRAMES       jump to COUNT sprites and hold for FRAMES
+        --saturate FPS[:START[:WINDOW]]
+                                  find the max sprite count sustaining FPS: double from START
+                                  until a step fails, then bisect; each step is judged on the
+                                  median frame time of WINDOW frames after SETTLE_FRAMES
+        --collide grid|naive      sprites bounce off each other; broadphase cost per sprite count
+                                  is reported under 'collision'
+        --world SCALE             world SCALE x WIN_SIZE with a scrolling camera; only sprites under
+                                  the viewport are drawn, visible counts are reported under 'camera'
+        --memory COUNT[:COUNT...] traced (tracemalloc) and RSS bytes per sprite at each COUNT,
+                                  measured after MEMORY_FRAMES frames against an empty scene
+        --fixed-step HZ           simulate in fixed ticks of 1 / HZ decoupled from the render clock,
+                                  interpolating positions for display
+        --sim-workers N           tick the simulation in N worker processes over shared memory,
+                                  fence waits and per-worker tick times are reported under 'simulation'
+        --sim-work N              N extra rounds of per-sprite math in every simulation tick
+        --scenario PATH           replay a seeded scenario file (see scenarios/) with its fixed dt
+        --out PATH                results file (default: bench_results/<backend>.json)
+        --headless                use SDL's dummy video driver (--video-driver to override)
+        --db PATH / --no-db       results database the run is recorded in (default: bench_results/results.sqlite)
+    """
+    SETTLE_FRAMES = 10
+    MEMORY_FRAMES = 3
+    MAX_SPRITES = 10_000_000
+
+    def __init__(self, app, backend, mode, spec):
+        self.app = app
+        self.backend = backend
+        self.mode = mode
+        self.spec = spec
+        self.out_path = get_arg('--out', os.path.join(RESULTS_DIR_PATH, f'{backend}.json'))
+        self.frame_times = []
+        self.sprite_counts = []
+        self.elapsed = 0.0
+        self.next_step = 0.0
+        self.frame = 0
+        self.last_time = None
+        self.finished = False
+        self.report = {}
+        if mode == 'saturate':
+            self.init_saturate()
+        elif mode == 'scenario':
+            self.init_scenario()
+        elif mode == 'memory':
+            self.init_memory()
+
+    @classmethod
+    def from_argv(cls, app, backend):
+        if '--scenario' in sys.argv:
+            with open(get_arg('--scenario')) as file:
+                return cls(app, backend, 'scenario', json.load(file))
+        for mode in ('--ramp', '--hold', '--saturate', '--memory'):
+            if mode in sys.argv:
+                spec = [float(value) for value in get_arg(mode).split(':')]
+                return cls(app, backend, mode[2:], spec)
+        return None
+
+    @property
+    def num_sprites(self):
+        return len(self.app.sprite_handler.sprites)
+
+    def set_num_sprites(self, num):
+        handler = self.app.sprite_handler
+        diff = int(num) - self.num_sprites
+        if diff > 0:
+            handler.add_sprite(WIN_W // 2, WIN_H // 2, diff)
+        elif diff < 0:
+            handler.del_sprite(-diff)
+
+    def step_ramp(self):
+        step, interval, max_sprites = self.spec
+        if self.elapsed < self.next_step:
+            return
+        if self.num_sprites >= max_sprites:
+            self.finished = True
+            return
+        self.set_num_sprites(min(self.num_sprites + step, max_sprites))
+        self.next_step += interval
+
+    def step_hold(self):
+        count, num_frames = self.spec
+        if not self.frame:
+            self.set_num_sprites(count)
+        elif self.frame > num_frames:
+            self.finished = True
+
+    def init_scenario(self):
+        self.fixed_dt = self.spec.get('dt')
+        events = []
+        for event in self.spec.get('events', []):
+            # "every": N repeats the event every N frames up to "until" (default: the last frame)
+            until = event.get('until', self.spec['frames']) if 'every' in event else event['frame']
+            events.extend(dict(event, frame=frame) for frame in range(event['frame'], until + 1, event.get('every', 1)))
+        self.events = sorted(events, key=lambda event: event['frame'])
+        self.event_ind = 0
+
+    def seed_scenario(self):
+        # SpriteUnits draw image, rot_vel, vel_x, vel_y from the global random in the same order in
+        # every backend, so reseeding here gives identical scenes across libraries
+        self.set_num_sprites(0)
+        random.seed(self.spec['seed'])
+        if self.app.sprite_handler.sim:
+            self.app.sprite_handler.sim.seed(self.spec['seed'])
+
+    def step_scenario(self):
+        if not self.frame:
+            self.seed_scenario()
+        handler = self.app.sprite_handler
+        while self.event_ind < len(self.events) and self.events[self.event_ind]['frame'] <= self.frame:
+            event = self.events[self.event_ind]
+            if 'spawn' in event:
+                handler.add_sprite(event.get('x', WIN_W // 2), event.get('y', WIN_H // 2), event['spawn'])
+            if 'despawn' in event:
+                handler.del_sprite(event['despawn'])
+            self.event_ind += 1
+        if self.frame >= self.spec['frames']:
+            self.finished = True
+        if self.fixed_dt:
+            self.app.dt = self.fixed_dt
+
+    def init_saturate(self):
+        target_fps, start, window = (self.spec + [1000, 60][len(self.spec) - 1:])[:3]
+        self.target_frame_time = 1 / target_fps
+        self.window = int(window)
+        self.count = int(start)
+        self.lo, self.hi = 0, None
+        self.step_start = 0
+        self.steps = []
+
+    def step_saturate(self):
+        if not self.frame:
+            self.set_num_sprites(self.count)
+            return
+        times = self.frame_times[self.step_start + self.SETTLE_FRAMES:]
+        if len(times) < self.window:
+            return
+
+        frame_time = statistics.median(times)
+        passed = frame_time <= self.target_frame_time
+        self.steps.append({'sprites': self.count, 'passed': passed, 'median_frame_time': frame_time,
+                           'mean_frame_time': statistics.fmean(times),
+                           'stdev_frame_time': statistics.stdev(times)})
+        if passed:
+            self.lo = self.count
+            self.count = self.count * 2 if self.hi is None else (self.lo + self.hi) // 2
+        else:
+            self.hi = self.count
+            self.count = (self.lo + self.hi) // 2
+
+        converged = self.hi is not None and self.hi - self.lo <= max(1, self.lo // 100)
+        if converged or self.count > self.MAX_SPRITES:
+            self.finish_saturate()
+            return
+        self.set_num_sprites(self.count)
+        self.step_start = len(self.frame_times)
+
+    def finish_saturate(self):
+        self.finished = True
+        passed = [step for step in self.steps if step['passed'] and step['sprites'] == self.lo]
+        best = passed[-1] if passed else {}
+        self.report = {
+            'target_fps': 1 / self.target_frame_time,
+            'max_sprites': self.lo,
+            'bracket': [self.lo, self.hi],
+            'frame_time_mean': best.get('mean_frame_time'),
+            'frame_time_variance': best.get('stdev_frame_time', 0.0) ** 2,
+            'steps': self.steps,
+        }
+        print(f'{self.backend}: {self.lo} sprites at {self.report["target_fps"] :.0f} FPS')
+
+    def init_memory(self):
+        # counts run in ascending order since freed memory is not always returned to the OS
+        self.counts = sorted(int(count) for count in self.spec)
+        self.step_start = 0
+        self.steps = []
+        tracemalloc.start()
+
+    def step_memory(self):
+        if not self.frame:
+            self.set_num_sprites(0)
+            return
+        if self.frame - self.step_start < self.MEMORY_FRAMES:
+            return
+
+        gc.collect()
+        self.steps.append({'sprites': self.num_sprites, 'traced_bytes': tracemalloc.get_traced_memory()[0],
+                           'rss_bytes': get_rss()})
+        if len(self.steps) > len(self.counts):
+            self.finish_memory()
+            return
+        self.set_num_sprites(self.counts[len(self.steps) - 1])
+        self.step_start = self.frame
+
+    def finish_memory(self):
+        self.finished = True
+        tracemalloc.stop()
+        base, steps = self.steps[0], self.steps[1:]
+        for step in steps:
+            step['traced_per_sprite'] = (step['traced_bytes'] - base['traced_bytes']) / step['sprites']
+            if step['rss_bytes'] is not None:
+                step['rss_per_sprite'] = (step['rss_bytes'] - base['rss_bytes']) / step['sprites']
+            print(f'{self.backend}: {step["sprites"]} sprites {step["traced_per_sprite"] :.0f} B/sprite traced, '
+                  f'{step.get("rss_per_sprite", 0) :.0f} B/sprite RSS')
+        self.report = {'baseline': base, 'steps': steps}
+
+    def update(self):
+        # a backend may still present frames while it shuts down
+        if self.finished:
+            return
+        now = time.perf_counter()
+        if self.last_time is not None:
+            frame_time = now - self.last_time
+            self.elapsed += frame_time
+            self.frame_times.append(frame_time)
+            self.sprite_counts.append(self.num_sprites)
+        self.last_time = now
+
+        if self.mode == 'ramp':
+            self.step_ramp()
+        elif self.mode == 'hold':
+            self.step_hold()
+        elif self.mode == 'scenario':
+            self.step_scenario()
+        elif self.mode == 'memory':
+            self.step_memory()
+        else:
+            self.step_saturate()
+        self.frame += 1
+
+        if self.finished:
+            self.save()
+            self.app.quit()
+
+    def get_summary(self):
+        steps = {}
+        for frame_time, count in zip(self.frame_times, self.sprite_counts):
+            steps.setdefault(count, []).append(frame_time)
+        return [{'sprites': count,
+                 'frames': len(times),
+                 'mean_frame_time': sum(times) / len(times),
+                 'mean_fps': len(times) / sum(times) if sum(times) else 0.0,
+                 'p99_frame_time': sorted(times)[min(int(len(times) * 0.99), len(times) - 1)],
+                 'max_frame_time': max(times)}
+                for count, times in sorted(steps.items())]
+
+    def get_results(self):
+        return {
+            'backend': self.backend,
+            'workload': {'mode': self.mode, 'spec': self.spec},
+            'settings': {'WIN_SIZE': WIN_SIZE, 'SPEED': SPEED, 'NUM_ANGLES': NUM_ANGLES,
+                         'NUM_SPRITES_PER_CLICK': NUM_SPRITES_PER_CLICK, 'FONT_SIZE': FONT_SIZE},
+            'system': {'python': platform.python_version(), 'platform': platform.platform(),
+                       'video_driver': os.environ.get('SDL_VIDEODRIVER', '')},
+            'argv': sys.argv[1:],
+            'frame_times': self.frame_times,
+            'sprite_counts': self.sprite_counts,
+            'summary': self.get_summary(),
+            'report': self.report,
+            'phases': self.app.timer.get_report(),
+            'stats': self.app.get_stats() if hasattr(self.app, 'get_stats') else {},
+            'collision': self.get_collision_report(),
+            'camera': self.app.sprite_handler.camera.get_report() if self.app.sprite_handler.camera else [],
+            'gc': self.app.gc_monitor.get_report() if self.app.gc_monitor else {},
+            'startup': self.get_startup_report(),
+            'simulation': self.app.sprite_handler.sim.get_stats() if self.app.sprite_handler.sim else {},
+        }
+
+    def get_startup_report(self):
+        asset_cache = self.app.sprite_handler.asset_cache
+        return {'time_to_first_frame': self.app.timer.first_frame,
+                'asset_cache': asset_cache.get_stats() if asset_cache else None}
+
+    def get_collision_report(self):
+        sim = self.app.sprite_handler.sim
+        if not (sim and sim.collider):
+            return []
+        return sim.collider.get_report()
+
+    def save(self):
+        out_dir = os.path.dirname(self.out_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        results = self.get_results()
+        with open(self.out_path, 'w') as file:
+            json.dump(results, file, indent=2)
+        if '--no-db' not in sys.argv:
+            ResultsDB().record(results)
+        print(f'{self.backend}: {len(self.frame_times)} frames written to {self.out_path}')